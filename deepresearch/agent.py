@@ -1,9 +1,15 @@
 import json
 import re
-from typing import List, Dict, Optional, Any, Tuple
+from typing import List, Dict, Optional, Any, Tuple, Set
 import asyncio
+import functools
+import itertools
+import time
+from collections import deque
 from datetime import datetime
+from email.utils import formatdate
 
+import orjson
 
 from .model_types import (
     RepeatEvaluationType,
@@ -40,7 +46,6 @@ from .utils.url_tools import (
     normalize_url,
     sort_select_urls,
     get_last_modified,
-    keep_k_per_hostname,
     process_urls,
     fix_bad_url_md_links,
     extract_urls_with_description,
@@ -50,12 +55,14 @@ from .utils.text_tools import (
     choose_k,
     convert_html_tables_to_md,
     fix_code_block_indentation,
+    PrecompiledTemplate,
     remove_extra_line_breaks,
     remove_html_tags,
     repair_markdown_final,
     repair_markdown_footnotes_outer,
 )
 from .config import (
+    DEBUG,
     MAX_QUERIES_PER_STEP,
     MAX_REFLECT_PER_STEP,
     MAX_URLS_PER_STEP,
@@ -97,6 +104,70 @@ Message = Dict[str, str]
 CoreMessage = Dict[str, str]
 all_context: List[Dict[str, Any]] = []  # 当前会话中的所有步骤，包括导致错误结果的步骤
 
+# 引用清理用的预编译正则
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+_MULTI_SPACE_RE = re.compile(r"\s+")
+
+MAX_CONCURRENT_DATETIME_LOOKUPS = 16  # update_references中同时猜测日期时间的最大请求数
+MAX_CONCURRENT_SEARCHES = 8  # execute_search_queries中同时进行的最大搜索请求数
+MAX_PENDING_CONTEXT_WRITES = 4  # 后台进行中的store_context写入任务上限
+MAX_RANKED_URLS = 300  # 每步排序后保留的URL数上限，只需选出前K个而无需全量排序
+
+# 没有失败搜索请求时的搜索动作提示片段，导入时格式化一次
+_SEARCH_SECTION_EMPTY = SEARCH_ACTION_TEMPLATE.format(bad_requests="")
+
+# (allow_search, allow_read, allow_answer, allow_reflect) -> 可用动作描述
+_ACTIONS_STR: Dict[Tuple[bool, bool, bool, bool], str] = {
+    flags: ", ".join(
+        name
+        for name, allowed in zip(("search", "read", "answer", "reflect"), flags)
+        if allowed
+    )
+    for flags in itertools.product((False, True), repeat=4)
+}
+
+# 每步都会格式化的提示和日记模板，导入时预先解析（调用处的.format用法不变）
+REVIEWER_TEMPLATE = PrecompiledTemplate(REVIEWER_TEMPLATE)
+ANSWER_REQUIREMENTS_TEMPLATE = PrecompiledTemplate(ANSWER_REQUIREMENTS_TEMPLATE)
+HEADER_TEMPLATE = PrecompiledTemplate(HEADER_TEMPLATE)
+CONTEXT_TEMPLATE = PrecompiledTemplate(CONTEXT_TEMPLATE)
+VISIT_ACTION_TEMPLATE = PrecompiledTemplate(VISIT_ACTION_TEMPLATE)
+SEARCH_ACTION_TEMPLATE = PrecompiledTemplate(SEARCH_ACTION_TEMPLATE)
+ACTIONS_WRAPPER_TEMPLATE = PrecompiledTemplate(ACTIONS_WRAPPER_TEMPLATE)
+BAD_REQUESTS_TEMPLATE = PrecompiledTemplate(BAD_REQUESTS_TEMPLATE)
+DIARY_FINAL_ANSWER_TEMPLATE = PrecompiledTemplate(DIARY_FINAL_ANSWER_TEMPLATE)
+DIARY_BAD_ANSWER_TEMPLATE = PrecompiledTemplate(DIARY_BAD_ANSWER_TEMPLATE)
+DIARY_SUBQUESTION_ANSWER_TEMPLATE = PrecompiledTemplate(DIARY_SUBQUESTION_ANSWER_TEMPLATE)
+DIARY_REFLECT_NEW_QUESTIONS_TEMPLATE = PrecompiledTemplate(DIARY_REFLECT_NEW_QUESTIONS_TEMPLATE)
+DIARY_REFLECT_NO_NEW_QUESTIONS_TEMPLATE = PrecompiledTemplate(DIARY_REFLECT_NO_NEW_QUESTIONS_TEMPLATE)
+DIARY_SEARCH_SUCCESS_TEMPLATE = PrecompiledTemplate(DIARY_SEARCH_SUCCESS_TEMPLATE)
+DIARY_SEARCH_FAIL_TEMPLATE = PrecompiledTemplate(DIARY_SEARCH_FAIL_TEMPLATE)
+DIARY_VISIT_SUCCESS_TEMPLATE = PrecompiledTemplate(DIARY_VISIT_SUCCESS_TEMPLATE)
+DIARY_VISIT_FAIL_TEMPLATE = PrecompiledTemplate(DIARY_VISIT_FAIL_TEMPLATE)
+DIARY_VISIT_NO_NEW_URLS_TEMPLATE = PrecompiledTemplate(DIARY_VISIT_NO_NEW_URLS_TEMPLATE)
+DIARY_CODING_SUCCESS_TEMPLATE = PrecompiledTemplate(DIARY_CODING_SUCCESS_TEMPLATE)
+DIARY_CODING_FAIL_TEMPLATE = PrecompiledTemplate(DIARY_CODING_FAIL_TEMPLATE)
+
+
+def _json_default(obj: Any) -> Any:
+    """JSON序列化无法直接处理的对象：pydantic模型转为字典，其他转为字符串"""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def dumps_json(obj: Any) -> str:
+    """序列化为缩进2格的JSON字符串，使用orjson，遇到orjson不支持的类型回退到标准库json"""
+    try:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+            default=_json_default,
+        ).decode("utf-8")
+    except TypeError:
+        pass
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=_json_default)
+
 
 async def sleep(ms: int) -> None:
     """等待指定的毫秒数"""
@@ -152,26 +223,93 @@ def compose_msgs(
     knowledge: List[KnowledgeItem],
     question: str,
     final_answer_pip: Optional[List[str]] = None,
+    knowledge_msgs: Optional[List[CoreMessage]] = None,
 ) -> List[CoreMessage]:
+    """组合知识消息、对话消息和当前问题
 
-    msgs = build_msgs_from_knowledge(knowledge) + messages
+    knowledge_msgs为调用方持有的缓存列表（knowledge只追加不修改时可用），
+    每次只为新增的知识项构建消息并追加到缓存中，避免重复构建历史知识。
+    """
+    if knowledge_msgs is None:
+        knowledge_msgs = build_msgs_from_knowledge(knowledge)
+    else:
+        # 每个知识项对应一对用户/助手消息
+        knowledge_msgs.extend(
+            build_msgs_from_knowledge(knowledge[len(knowledge_msgs) // 2 :])
+        )
+
+    msgs = knowledge_msgs + messages
 
     user_content = question
     if final_answer_pip:
-        reviewers_content = ""
-        for idx, pip in enumerate(final_answer_pip, 1):
-            reviewers_content += REVIEWER_TEMPLATE.format(idx=idx, pip=pip)
+        # 一次join拼接全部评审意见，避免逐个+=产生的重复拷贝
+        reviewers_content = "".join(
+            REVIEWER_TEMPLATE.format(idx=idx, pip=pip)
+            for idx, pip in enumerate(final_answer_pip, 1)
+        )
 
         user_content += ANSWER_REQUIREMENTS_TEMPLATE.format(reviewers=reviewers_content)
 
     msgs.append({"role": "user", "content": remove_extra_line_breaks(user_content)})
 
-    if len(msgs) > 1 and msgs[-2] == msgs[-1]:
-        return msgs[:-1]
+    # 先比较角色和内容长度，相同时才做完整比较
+    if len(msgs) > 1:
+        prev_msg, last_msg = msgs[-2], msgs[-1]
+        if (
+            prev_msg["role"] == last_msg["role"]
+            and len(prev_msg["content"]) == len(last_msg["content"])
+            and prev_msg == last_msg
+        ):
+            return msgs[:-1]
 
     return msgs
 
 
+@functools.lru_cache(maxsize=1)
+def _build_header(epoch_minute: int) -> str:
+    """按分钟格式化提示头部，同一分钟内的多次调用直接复用，分钟变化时自动失效"""
+    return HEADER_TEMPLATE.format(date=formatdate(epoch_minute * 60, usegmt=True))
+
+
+@functools.lru_cache(maxsize=64)
+def _build_actions(
+    flags: Tuple[bool, bool, bool, bool, bool, bool], bad_requests: str, url_list_str: str
+) -> str:
+    """组装动作部分
+
+    Args:
+        flags: (allow_read, allow_search, allow_answer, beast_mode, allow_reflect, allow_coding)
+        bad_requests: 已格式化的已搜索关键词提示，为空表示无
+        url_list_str: 已格式化的可访问URL列表，为空表示无
+    """
+    allow_read, allow_search, allow_answer, beast_mode, allow_reflect, allow_coding = flags
+    action_sections: List[str] = []
+
+    if allow_read and url_list_str:
+        action_sections.append(VISIT_ACTION_TEMPLATE.format(url_list_str=url_list_str))
+
+    if allow_search:
+        action_sections.append(
+            _SEARCH_SECTION_EMPTY
+            if not bad_requests
+            else SEARCH_ACTION_TEMPLATE.format(bad_requests=bad_requests)
+        )
+
+    if allow_answer:
+        action_sections.append(ANSWER_ACTION_TEMPLATE)
+
+    if beast_mode:
+        action_sections.append(BEAST_MODE_TEMPLATE)
+
+    if allow_reflect:
+        action_sections.append(REFLECT_ACTION_TEMPLATE)
+
+    if allow_coding:
+        action_sections.append(CODING_ACTION_TEMPLATE)
+
+    return ACTIONS_WRAPPER_TEMPLATE.format(actions="\n".join(action_sections))
+
+
 def get_prompt(
     context: Optional[List[str]] = None,
     all_keywords: Optional[List[str]] = None,
@@ -185,13 +323,10 @@ def get_prompt(
 ) -> Tuple[str, Optional[List[str]]]:
 
     sections: List[str] = []
-    action_sections: List[str] = []
 
-    # 添加头部
+    # 添加头部（按分钟粒度缓存）
     sections.append(
-        HEADER_TEMPLATE.format(
-            date=datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
-        )
+        _build_header(int(time.time() // 60))
     )
 
     # 添加上下文
@@ -200,36 +335,24 @@ def get_prompt(
 
     # 构建动作部分
     url_list = sort_select_urls(all_urls or [], MAX_URLS_READ_PER_STEP)
+    url_list_str = ""
     if allow_read and url_list:
         url_list_str = "\n".join(
             f"  - [idx={idx+1}] [weight={item['score']:.2f}] \"{item['url']}\": \"{item['merged'][:50]}\""
             for idx, item in enumerate(url_list)
         )
 
-        action_sections.append(VISIT_ACTION_TEMPLATE.format(url_list_str=url_list_str))
-
-    if allow_search:
-        bad_requests = ""
-        if all_keywords:  # 搜过的就不用再搜了
-            bad_requests = BAD_REQUESTS_TEMPLATE.format(
-                keywords="\n".join(all_keywords)
-            )
-
-        action_sections.append(SEARCH_ACTION_TEMPLATE.format(bad_requests=bad_requests))
-
-    if allow_answer:
-        action_sections.append(ANSWER_ACTION_TEMPLATE)
-
-    if beast_mode:
-        action_sections.append(BEAST_MODE_TEMPLATE)
-
-    if allow_reflect:
-        action_sections.append(REFLECT_ACTION_TEMPLATE)
-
-    if allow_coding:
-        action_sections.append(CODING_ACTION_TEMPLATE)
+    bad_requests = ""
+    if allow_search and all_keywords:  # 搜过的就不用再搜了
+        bad_requests = BAD_REQUESTS_TEMPLATE.format(keywords="\n".join(all_keywords))
 
-    sections.append(ACTIONS_WRAPPER_TEMPLATE.format(actions="\n".join(action_sections)))
+    sections.append(
+        _build_actions(
+            (allow_read, allow_search, allow_answer, beast_mode, allow_reflect, allow_coding),
+            bad_requests,
+            url_list_str,
+        )
+    )
 
     # 添加页脚
     sections.append(FOOTER_TEMPLATE)
@@ -250,14 +373,17 @@ async def update_references(
     if not this_step.references:
         return
 
-    new_refs: List[Reference] = []
-    for ref in this_step.references:
+    # 限制并发的日期时间猜测请求数
+    datetime_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DATETIME_LOOKUPS)
+
+    async def finalize_ref(ref: Reference) -> Optional[Reference]:
+        """规范化单个引用，并在缺少日期时间时并行猜测"""
         if not ref or not ref.url:
-            continue
+            return None
 
         normalized_url = normalize_url(ref.url)
         if not normalized_url:
-            continue
+            return None
 
         exact_quote = (
             ref.exact_quote
@@ -266,11 +392,9 @@ async def update_references(
             or ""
         )
 
-        # Clean up the text by replacing non-alphanumeric characters with spaces
-        exact_quote = re.sub(r"[^\w\s]", " ", exact_quote)
-
-        # Replace multiple spaces with a single space
-        exact_quote = re.sub(r"\s+", " ", exact_quote)
+        # Clean up the text by replacing non-alphanumeric characters with spaces,
+        # then collapse multiple spaces into a single space
+        exact_quote = _MULTI_SPACE_RE.sub(" ", _NON_WORD_RE.sub(" ", exact_quote))
 
         new_ref = Reference(
             exact_quote=exact_quote,
@@ -278,16 +402,21 @@ async def update_references(
             url=normalized_url,
             date_time=ref.date_time or all_urls[normalized_url].date or "",
         )
-        new_refs.append(new_ref)
 
-    this_step.references = new_refs
+        if not new_ref.date_time:
+            async with datetime_semaphore:
+                new_ref.date_time = await get_last_modified(new_ref.url) or ""
 
-    # 并行处理猜测所有url日期时间
-    async def update_datetime(ref: Reference):
-        if not ref.date_time:
-            ref.date_time = await get_last_modified(ref.url) or ""
+        return new_ref
 
-    await asyncio.gather(*[update_datetime(ref) for ref in this_step.references])
+    # 规范化与日期时间猜测在同一批协程中并行完成
+    this_step.references = [
+        r
+        for r in await asyncio.gather(
+            *[finalize_ref(ref) for ref in this_step.references]
+        )
+        if r is not None
+    ]
 
     print("【Updated references】:", this_step.references)
 
@@ -327,8 +456,14 @@ async def execute_search_queries(
         {"keywords": ", ".join(uniq_q_only)},
     )
 
-    # ---------- 2. 执行每个查询 ----------
-    for query in keywords_queries:
+    # ---------- 2. 并发执行所有查询 ----------
+    # 限制同时进行的搜索请求数，避免触发搜索提供商的频率限制
+    search_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+
+    async def run_one(
+        query: Dict[str, Any]
+    ) -> Optional[Tuple[Dict[str, Any], str, List[SearchSnippet]]]:
+        """执行单个查询，返回(查询, 原始查询文本, 标准化结果)，失败时返回None"""
         # 保存原始查询文本
         old_query = query["q"]
 
@@ -344,11 +479,12 @@ async def execute_search_queries(
             print("【execute_search_queries】:", query)
 
             # 根据配置的搜索提供商执行搜索
-            if SEARCH_PROVIDER == "jina":
-                search_result = await search(query["q"], tracker_context)
-                results = search_result.data if search_result.data else []
-            else:
-                results = []
+            async with search_semaphore:
+                if SEARCH_PROVIDER == "jina":
+                    search_result = await search(query["q"], tracker_context)
+                    results = search_result.data if search_result.data else []
+                else:
+                    results = []
 
             # 如果没有结果，抛出异常
             if not results:
@@ -356,11 +492,7 @@ async def execute_search_queries(
 
         except Exception as error:
             print(f"{SEARCH_PROVIDER} search failed for query:", query, error)
-            continue  # 跳过当前查询，继续下一个
-
-        finally:
-            # 无论搜索成功与否，都等待一段时间避免请求过于频繁
-            await sleep(STEP_SLEEP)
+            return None  # 跳过当前查询
 
         # ---------- 2.2 处理搜索结果 ----------
         # 将搜索结果标准化为SearchSnippet格式
@@ -384,6 +516,16 @@ async def execute_search_queries(
                 )
             )
 
+        return query, old_query, min_results
+
+    search_outcomes = await asyncio.gather(*[run_one(q) for q in keywords_queries])
+
+    # 按查询顺序汇总结果，保证URL集合和知识项的顺序稳定
+    for outcome in search_outcomes:
+        if outcome is None:
+            continue
+        query, old_query, min_results = outcome
+
         # ---------- 2.3 添加结果到URL集合 ----------
         # 将每个结果添加到全局URL字典，并累计效用分数
         for r in min_results:
@@ -398,9 +540,9 @@ async def execute_search_queries(
             KnowledgeItem(
                 type="side-info",  # 类型为侧面信息
                 question=f'What do Internet say about "{old_query}"?',  # 构建问题
-                answer=remove_html_tags(
-                    "; ".join(r.description for r in min_results)
-                ),  # 合并所有描述作为答案
+                answer="; ".join(
+                    remove_html_tags(r.description) for r in min_results
+                ),  # 逐条去除HTML标签后合并所有描述作为答案
                 updated=(
                     format_date_range(query) if query.get("tbs") else None
                 ),  # 添加日期范围（如果有）
@@ -497,7 +639,10 @@ async def get_response(
 
     # ---------- 初始化核心变量 ----------
     # 问题和知识管理
-    gaps = [question]  # 待解决的问题队列
+    # 待解决的问题队列：deque负责轮询，pending_gaps记录仍未解决的问题，
+    # 已解决的问题只从集合中移除，轮询到队首时再惰性弹出
+    gaps = deque([question])
+    pending_gaps: Set[str] = {question}
     all_questions = [question]  # 所有问题历史记录
     all_keywords: List[str] = []  # 搜索关键词历史
     all_knowledge: List[KnowledgeItem] = []  # 中间问题的答案知识
@@ -507,6 +652,9 @@ async def get_response(
     weighted_urls: List[BoostedSearchSnippet] = []  # 排序后的URL列表
     visited_urls: List[str] = []  # 已访问的URL
     bad_urls: List[str] = []  # 无效的URL
+    # 与上面两个列表同步维护的集合，用于O(1)成员判断；列表保留访问顺序
+    visited_urls_set: Set[str] = set()
+    bad_urls_set: Set[str] = set()
 
     # 操作控制标志
     allow_answer = True  # 允许直接回答
@@ -518,13 +666,13 @@ async def get_response(
     # 上下文和响应管理
     diary_context: List[str] = []  # 日志上下文
     msg_with_knowledge: List[CoreMessage] = []  # 带知识的消息
-    this_step: StepAction = {  # 当前步骤动作
-        "action": "answer",
-        "answer": "",
-        "references": [],
-        "think": "",
-        "is_final": False,
-    }
+    knowledge_msgs: List[CoreMessage] = []  # all_knowledge对应消息的增量缓存
+    knowledge_strings: List[str] = []  # all_knowledge格式化字符串的增量缓存，供严格评估使用
+    context_tasks: deque = deque()  # 进行中的store_context任务
+    sandbox = CodeSandbox(None, tracker_context, json_schema_gen)  # 本次运行复用的代码沙箱
+    this_step: StepAction = AnswerAction(  # 当前步骤动作
+        action="answer", answer="", references=[], think="", is_final=False
+    )
 
     # 评估和预算管理
     regular_budget = token_budget * 0.85  # 常规预算（保留15%给beast模式）
@@ -548,330 +696,350 @@ async def get_response(
         for u in extract_urls_with_description(content):
             add_to_all_urls(u, all_urls)
 
-    # ---------- 主处理循环 ----------
-    while (
-        tracker_context.token_tracker.get_total_usage()["total_tokens"] < regular_budget
-    ):
-        # 更新步骤计数器
-        step += 1
-        total_step += 1
-
-        # 计算预算使用百分比
-        budget_percentage = (
-            tracker_context.token_tracker.get_total_usage()["total_tokens"]
-            / token_budget
-            * 100
-        )
-
-        # 轮询选择当前问题
-        current_question = gaps[total_step % len(gaps)]
-
-        # 打印当前步骤信息
-        print("\n" + "=" * 50)
-        print(f"步骤 {total_step} / 预算使用 {budget_percentage:.2f}%")
-        print("=" * 50)
-        print(f"【待解决问题】: {gaps}")
-        print(f"【当前问题】: {current_question}")
-
-        # ---------- 问题评估设置 ----------
-        # 处理原始问题（第一步）
-        if current_question.strip() == question and total_step == 1:
-            # 为原始问题设置评估指标
-            evaluation_metrics[current_question] = [
-                RepeatEvaluationType(type=e, num_evals_required=max_bad_attempts)
-                for e in (
-                    await evaluate_question(
-                        current_question, tracker_context, json_schema_gen
-                    )
+    try:
+        # ---------- 主处理循环 ----------
+        while (used_tokens := tracker_context.token_tracker.total_tokens) < regular_budget:
+            step_started = time.monotonic()
+
+            # 更新步骤计数器
+            step += 1
+            total_step += 1
+
+            # 计算预算使用百分比
+            budget_percentage = used_tokens / token_budget * 100
+
+            # 轮询选择当前问题（先丢弃队首已解决的问题）
+            while gaps[0] not in pending_gaps:
+                gaps.popleft()
+            current_question = gaps[0]
+            gaps.rotate(-1)
+
+            # 打印当前步骤信息
+            print("\n" + "=" * 50)
+            print(f"步骤 {total_step} / 预算使用 {budget_percentage:.2f}%")
+            print("=" * 50)
+            print(f"【待解决问题】: {[q for q in gaps if q in pending_gaps]}")
+            print(f"【当前问题】: {current_question}")
+
+            # ---------- 问题评估设置 ----------
+            # 处理原始问题（第一步）：问题评估与下面的URL排序互不依赖，
+            # 先启动评估请求，排序完成后再等待结果
+            question_eval_task: Optional[asyncio.Task] = None
+            if current_question == question and total_step == 1:
+                question_eval_task = asyncio.create_task(
+                    evaluate_question(current_question, tracker_context, json_schema_gen)
                 )
-            ]
-            # 额外添加严格评估类型
-            evaluation_metrics[current_question].append(
-                RepeatEvaluationType(
-                    type=EvaluationType.STRICT, num_evals_required=max_bad_attempts
+            # 处理子问题
+            elif current_question != question:
+                # 子问题使用空评估指标列表
+                evaluation_metrics[current_question] = []
+
+            # ---------- URL处理与排序 ----------
+            if all_urls:
+                # 过滤、排序URL，每个域名最多保留2个URL，增加信息来源多样性
+                try:
+                    weighted_urls = await rank_urls(
+                        filter_urls(all_urls, visited_urls_set, bad_hostnames, only_hostnames),
+                        {
+                            "question": current_question,
+                            "boost_hostnames": boost_hostnames,
+                            "k_per_hostname": 2,
+                            "max_results": max(MAX_RANKED_URLS, num_returned_urls),
+                        },
+                        tracker_context,
+                    )
+                except Exception:
+                    # 排序失败时仍等待已发出的问题评估完成，避免遗留未取回的任务异常和未统计的令牌用量
+                    if question_eval_task is not None:
+                        await asyncio.gather(question_eval_task, return_exceptions=True)
+                    raise
+                print("【每个域名最多保留2个URL】:", len(weighted_urls))
+
+            if question_eval_task is not None:
+                # 为原始问题设置评估指标
+                evaluation_metrics[current_question] = [
+                    RepeatEvaluationType(type=e, num_evals_required=max_bad_attempts)
+                    for e in await question_eval_task
+                ]
+                # 额外添加严格评估类型
+                evaluation_metrics[current_question].append(
+                    RepeatEvaluationType(
+                        type=EvaluationType.STRICT, num_evals_required=max_bad_attempts
+                    )
                 )
-            )
-        # 处理子问题
-        elif current_question.strip() != question:
-            # 子问题使用空评估指标列表
-            evaluation_metrics[current_question] = []
-
-        # ---------- URL处理与排序 ----------
-        if all_urls:
-            # 过滤、排序URL
-            weighted_urls = await rank_urls(
-                filter_urls(all_urls, visited_urls, bad_hostnames, only_hostnames),
-                {"question": current_question, "boost_hostnames": boost_hostnames},
-                tracker_context,
-            )
-            # 每个域名最多保留2个URL，增加信息来源多样性
-            weighted_urls = keep_k_per_hostname(weighted_urls, 2)
-            print("【每个域名最多保留2个URL】:", len(weighted_urls))
-
-        # 处理需要最新信息的问题
-        if total_step == 1 and includes_eval(
-            evaluation_metrics[current_question], EvaluationType.FRESHNESS
-        ):
-            # 强制搜索最新信息，禁用直接回答和反思
-            allow_answer = False
-            allow_reflect = False
 
-        # 动态调整操作许可
-        allow_read = allow_read and weighted_urls  # 只有当有URL时才允许阅读
-        allow_search = allow_search and len(weighted_urls) < 200  # 防止过度搜索
-        allow_reflect = allow_reflect and (
-            len(gaps) <= MAX_REFLECT_PER_STEP
-        )  # 限制反思次数
-
-
-        if step == 1:
-            allow_search = True
-            allow_read = False
-            allow_answer = False
-            allow_reflect = False
-            allow_coding = False
-        if step == 2:
-            allow_search = False
-            allow_read = True
-            allow_answer = False
-            allow_reflect = False
-            allow_coding = False
-        if step == 3:
-            allow_search = False
-            allow_read = False
-            allow_answer = True
-            allow_reflect = False
-            allow_coding = False
-        if step == 4:
-            allow_search = False
-            allow_read = False
-            allow_answer = False
-            allow_reflect = True
-            allow_coding = False
-
-
-        # ---------- 生成提示和模式 ----------
-        # 构建提示信息
-        prompt, url_list = get_prompt(
-            context=diary_context,
-            all_keywords=all_keywords,
-            allow_reflect=allow_reflect,
-            allow_answer=allow_answer,
-            allow_read=allow_read,
-            allow_search=allow_search,
-            allow_coding=allow_coding,
-            all_urls=all_urls,
-            beast_mode=False,
-        )
-
-        # 根据当前问题和允许的操作生成模式
-        schema = json_schema_gen.get_agent_schema(
-            allow_reflect,
-            allow_read,
-            allow_answer,
-            allow_search,
-            allow_coding,
-            current_question,
-        )
-
-        # 组合消息和知识
-        msg_with_knowledge = compose_msgs(
-            messages,
-            all_knowledge,
-            current_question,
-            final_answer_pip if current_question == question else None,
-        )
-
-        print(f"【prompt】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{prompt}")
-        print(
-            f"【messages】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{json.dumps(msg_with_knowledge, indent=4, ensure_ascii=False)}"
-        )
+            # 处理需要最新信息的问题
+            if total_step == 1 and includes_eval(
+                evaluation_metrics[current_question], EvaluationType.FRESHNESS
+            ):
+                # 强制搜索最新信息，禁用直接回答和反思
+                allow_answer = False
+                allow_reflect = False
+
+            # 动态调整操作许可
+            allow_read = allow_read and weighted_urls  # 只有当有URL时才允许阅读
+            allow_search = allow_search and len(weighted_urls) < 200  # 防止过度搜索
+            allow_reflect = allow_reflect and (
+                len(pending_gaps) <= MAX_REFLECT_PER_STEP
+            )  # 限制反思次数
+
+
+            if step == 1:
+                allow_search = True
+                allow_read = False
+                allow_answer = False
+                allow_reflect = False
+                allow_coding = False
+            if step == 2:
+                allow_search = False
+                allow_read = True
+                allow_answer = False
+                allow_reflect = False
+                allow_coding = False
+            if step == 3:
+                allow_search = False
+                allow_read = False
+                allow_answer = True
+                allow_reflect = False
+                allow_coding = False
+            if step == 4:
+                allow_search = False
+                allow_read = False
+                allow_answer = False
+                allow_reflect = True
+                allow_coding = False
 
-        # ---------- 生成代理动作 ----------
-        result = await generator.generate_object(
-            {
-                "model": "agent",
-                "schema": schema,
-                "system": prompt,
-                "messages": msg_with_knowledge,
-                "num_retries": 2,
-            }
-        )
 
-        # 根据动作类型动态实例化对应的Action类
-        action_type = result.object["action"]
-        action_class = {
-            "search": SearchAction,
-            "answer": AnswerAction,
-            "reflect": ReflectAction,
-            "visit": VisitAction,
-            "coding": CodingAction,
-        }[action_type]
-
-        # 构建步骤动作
-        this_step = action_class(
-            action=action_type,
-            think=result.object["think"],
-            **result.object[action_type],
-        )
+            # ---------- 生成提示和模式 ----------
+            # 构建提示信息
+            prompt, url_list = get_prompt(
+                context=diary_context,
+                all_keywords=all_keywords,
+                allow_reflect=allow_reflect,
+                allow_answer=allow_answer,
+                allow_read=allow_read,
+                allow_search=allow_search,
+                allow_coding=allow_coding,
+                all_urls=all_urls,
+                beast_mode=False,
+            )
 
-        # 打印允许的动作
-        actions_str = ", ".join(
-            action
-            for action, allowed in [
-                ("search", allow_search),
-                ("read", allow_read),
-                ("answer", allow_answer),
-                ("reflect", allow_reflect),
-            ]
-            if allowed
-        )
+            # 根据当前问题和允许的操作生成模式
+            schema = json_schema_gen.get_agent_schema(
+                allow_reflect,
+                allow_read,
+                allow_answer,
+                allow_search,
+                allow_coding,
+                current_question,
+            )
 
-        print("【Action 选择】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-        print(f"[选择动作]: {this_step.action} <- [可用动作: {actions_str}]")
-        print("[动作详情]: ", this_step)
+            # 组合消息和知识
+            msg_with_knowledge = compose_msgs(
+                messages,
+                all_knowledge,
+                current_question,
+                final_answer_pip if current_question == question else None,
+                knowledge_msgs,
+            )
 
-        tracker_context.action_tracker.track_action(
-            {
-                "total_step": total_step,
-                "this_step": this_step.__dict__,
-                "gaps": gaps,
-            }
-        )
+            if DEBUG:
+                # 提示和消息列表随步数增长，序列化和输出开销大且阻塞事件循环，仅在调试时输出
+                print(f"【prompt】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{prompt}")
+                print(
+                    f"【messages】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{dumps_json(msg_with_knowledge)}"
+                )
 
-        # 重置标志
-        allow_answer = True
-        allow_reflect = True
-        allow_read = True
-        allow_search = True
-        allow_coding = True
-
-        # 执行步骤和动作
-        if this_step.action == "answer" and this_step.answer:
-            # ======== 回答动作处理 ========
-            # 1. 更新引用，确保URL和引用信息正确
-            await update_references(this_step, all_urls)
+            # ---------- 生成代理动作 ----------
+            result = await generator.generate_object(
+                {
+                    "model": "agent",
+                    "schema": schema,
+                    "system": prompt,
+                    "messages": msg_with_knowledge,
+                    "num_retries": 2,
+                }
+            )
 
-            # 2. 处理简单问题的直接回答情况
-            if total_step == 1 and not this_step.references and not no_direct_answer:
-                this_step.is_final = True
-                trivial_question = True
-                break
-
-            # 3. 处理引用中的URL
-            if this_step.references:
-                # 3.1 收集新的URL
-                urls = [
-                    ref.url
-                    for ref in this_step.references
-                    if ref.url not in visited_urls
-                ]
-                unique_new_urls = list(set(urls))
+            # 根据动作类型动态实例化对应的Action类
+            action_type = result.object["action"]
+            action_class = {
+                "search": SearchAction,
+                "answer": AnswerAction,
+                "reflect": ReflectAction,
+                "visit": VisitAction,
+                "coding": CodingAction,
+            }[action_type]
+
+            # 构建步骤动作
+            this_step = action_class(
+                action=action_type,
+                think=result.object["think"],
+                **result.object[action_type],
+            )
 
-                # 3.2 处理这些URL，获取内容
-                await process_urls(
-                    unique_new_urls,
-                    tracker_context,
-                    all_knowledge,
-                    all_urls,
-                    visited_urls,
-                    bad_urls,
-                    json_schema_gen,
-                    current_question,
+            # 打印允许的动作
+            actions_str = _ACTIONS_STR[
+                (
+                    bool(allow_search),
+                    bool(allow_read),
+                    bool(allow_answer),
+                    bool(allow_reflect),
                 )
+            ]
 
-                # 3.3 过滤掉坏URL的引用
-                this_step.references = [
-                    ref for ref in this_step.references if ref.url not in bad_urls
-                ]
+            print("【Action 选择】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
+            print(f"[选择动作]: {this_step.action} <- [可用动作: {actions_str}]")
+            print("[动作详情]: ", this_step)
 
-            # 4. 更新上下文
-            update_context(
+            tracker_context.action_tracker.track_action(
                 {
                     "total_step": total_step,
-                    "question": current_question,
-                    **this_step.dict(),
+                    "this_step": this_step.__dict__,
+                    "gaps": [q for q in gaps if q in pending_gaps],
                 }
             )
 
-            # 5. 评估回答质量
-            print(f"【评估问题】: {current_question}")
-            print(f"【评估指标】: {evaluation_metrics[current_question]}")
-            evaluation = EvaluationResponse.model_construct(pass_eval=True, think="")
+            # 重置标志
+            allow_answer = True
+            allow_reflect = True
+            allow_read = True
+            allow_search = True
+            allow_coding = True
 
-            if evaluation_metrics[current_question]:
-                tracker_context.action_tracker.track_think(
-                    "eval_first", json_schema_gen.language_code
-                )
-                evaluation = (
-                    await evaluate_answer(
-                        current_question,
-                        this_step,
-                        [e.type for e in evaluation_metrics[current_question]],
+            # 执行步骤和动作
+            step_dict: Optional[Dict[str, Any]] = None  # 本步this_step的序列化结果，供store_context复用
+            if this_step.action == "answer" and this_step.answer:
+                # ======== 回答动作处理 ========
+                # 1. 更新引用，确保URL和引用信息正确
+                await update_references(this_step, all_urls)
+
+                # 2. 处理简单问题的直接回答情况
+                if total_step == 1 and not this_step.references and not no_direct_answer:
+                    this_step.is_final = True
+                    trivial_question = True
+                    break
+
+                # 3. 处理引用中的URL
+                if this_step.references:
+                    # 3.1 收集新的URL
+                    unique_new_urls = list(
+                        {
+                            ref.url
+                            for ref in this_step.references
+                            if ref.url not in visited_urls_set
+                        }
+                    )
+
+                    # 3.2 处理这些URL，获取内容
+                    visited_len, bad_len = len(visited_urls), len(bad_urls)
+                    await process_urls(
+                        unique_new_urls,
                         tracker_context,
                         all_knowledge,
+                        all_urls,
+                        visited_urls,
+                        bad_urls,
                         json_schema_gen,
+                        current_question,
                     )
-                    or evaluation
+                    visited_urls_set.update(visited_urls[visited_len:])
+                    bad_urls_set.update(bad_urls[bad_len:])
+
+                    # 3.3 过滤掉坏URL的引用
+                    this_step.references = [
+                        ref for ref in this_step.references if ref.url not in bad_urls_set
+                    ]
+
+                # 4. 更新上下文
+                step_dict = this_step.model_dump()
+                update_context(
+                    {
+                        "total_step": total_step,
+                        "question": current_question,
+                        **step_dict,
+                    }
                 )
 
-            # 6. 处理原始问题的回答
-            if current_question.strip() == question:
-                allow_coding = False
+                # 5. 评估回答质量
+                print(f"【评估问题】: {current_question}")
+                print(f"【评估指标】: {evaluation_metrics[current_question]}")
+                evaluation = EvaluationResponse.model_construct(pass_eval=True, think="")
 
-                # 6.1 如果评估通过，完成处理
-                if evaluation.pass_eval:
-                    diary_context.append(
-                        DIARY_FINAL_ANSWER_TEMPLATE.format(
-                            step=step,
-                            question=current_question,
-                            answer=this_step.answer,
-                            evaluation_think=evaluation.think,
-                        )
+                if evaluation_metrics[current_question]:
+                    tracker_context.action_tracker.track_think(
+                        "eval_first", json_schema_gen.language_code
                     )
-                    this_step.is_final = True
-                    break
-                # 6.2 如果评估不通过，更新评估指标并尝试改进
-                else:
-                    evaluation_metrics[current_question] = [
-                        e
-                        for e in evaluation_metrics[current_question]
-                        if (
-                            e.type != evaluation.type
-                            or (e.type == evaluation.type and e.num_evals_required > 1)
+                    evaluation = (
+                        await evaluate_answer(
+                            current_question,
+                            this_step,
+                            [e.type for e in evaluation_metrics[current_question]],
+                            tracker_context,
+                            all_knowledge,
+                            json_schema_gen,
+                            knowledge_strings,
                         )
-                    ]
-
-                    # 收集改进计划
-                    if (
-                        evaluation.type == EvaluationType.STRICT
-                    ) and evaluation.improvement_plan:
-                        final_answer_pip.append(evaluation.improvement_plan)
+                        or evaluation
+                    )
 
-                    # 如果没有更多评估指标，停止处理
-                    if not evaluation_metrics[current_question]:
-                        this_step.is_final = False
+                # 6. 处理原始问题的回答
+                if current_question == question:
+                    allow_coding = False
+
+                    # 6.1 如果评估通过，完成处理
+                    if evaluation.pass_eval:
+                        diary_context.append(
+                            DIARY_FINAL_ANSWER_TEMPLATE.format(
+                                step=step,
+                                question=current_question,
+                                answer=this_step.answer,
+                                evaluation_think=evaluation.think,
+                            )
+                        )
+                        this_step.is_final = True
                         break
-
-                    # 记录失败原因
-                    diary_context.append(
-                        DIARY_BAD_ANSWER_TEMPLATE.format(
-                            step=step,
-                            question=current_question,
-                            answer=this_step.answer,
-                            evaluation_think=evaluation.think,
+                    # 6.2 如果评估不通过，更新评估指标并尝试改进
+                    else:
+                        evaluation_metrics[current_question] = [
+                            e
+                            for e in evaluation_metrics[current_question]
+                            if (
+                                e.type != evaluation.type
+                                or (e.type == evaluation.type and e.num_evals_required > 1)
+                            )
+                        ]
+
+                        # 收集改进计划
+                        if (
+                            evaluation.type == EvaluationType.STRICT
+                        ) and evaluation.improvement_plan:
+                            final_answer_pip.append(evaluation.improvement_plan)
+
+                        # 如果没有更多评估指标，停止处理
+                        if not evaluation_metrics[current_question]:
+                            this_step.is_final = False
+                            break
+
+                        # 记录失败原因
+                        diary_context.append(
+                            DIARY_BAD_ANSWER_TEMPLATE.format(
+                                step=step,
+                                question=current_question,
+                                answer=this_step.answer,
+                                evaluation_think=evaluation.think,
+                            )
                         )
-                    )
 
-                    # 分析错误并添加到知识
-                    error_analysis = await analyze_steps(
-                        diary_context, tracker_context, json_schema_gen
-                    )
+                        # 分析错误并添加到知识
+                        error_analysis = await analyze_steps(
+                            diary_context, tracker_context, json_schema_gen
+                        )
 
-                    all_knowledge.append(
-                        KnowledgeItem(
-                            type="qa",
-                            question=f"""
+                        all_knowledge.append(
+                            KnowledgeItem(
+                                type="qa",
+                                question=f"""
 为什么下面这个答案对这个问题来说不好呢？请反思一下。
 
 <question>
@@ -882,7 +1050,7 @@ async def get_response(
 {this_step.answer}
 </answer>
 """,
-                            answer=f"""
+                                answer=f"""
 {evaluation.think}
 
 {error_analysis.recap}
@@ -891,420 +1059,461 @@ async def get_response(
 
 {error_analysis.improvement}
 """,
+                            )
                         )
-                    )
 
-                    # 重置参数准备下一轮尝试
-                    allow_answer = False
-                    # diary_context = []
-                    # step = 0
+                        # 重置参数准备下一轮尝试
+                        allow_answer = False
+                        # diary_context = []
+                        # step = 0
 
-            # 7. 处理子问题的回答
-            elif evaluation.pass_eval:
-                diary_context.append(
-                    DIARY_SUBQUESTION_ANSWER_TEMPLATE.format(
-                        step=step,
-                        question=current_question,
-                        answer=this_step.answer,
-                        evaluation_think=evaluation.think,
+                # 7. 处理子问题的回答
+                elif evaluation.pass_eval:
+                    diary_context.append(
+                        DIARY_SUBQUESTION_ANSWER_TEMPLATE.format(
+                            step=step,
+                            question=current_question,
+                            answer=this_step.answer,
+                            evaluation_think=evaluation.think,
+                        )
                     )
-                )
 
-                # 将子问题答案添加到知识库
-                all_knowledge.append(
-                    KnowledgeItem(
-                        type="qa",
-                        question=current_question,
-                        answer=this_step.answer,
-                        references=this_step.references,
-                        updated=format_date_based_on_type(datetime.now(), "full"),
+                    # 将子问题答案添加到知识库
+                    all_knowledge.append(
+                        KnowledgeItem(
+                            type="qa",
+                            question=current_question,
+                            answer=this_step.answer,
+                            references=this_step.references,
+                            updated=format_date_based_on_type(datetime.now(), "full"),
+                        )
                     )
-                )
 
-                # 从缺口中移除已回答的问题
-                gaps.remove(current_question)
+                    # 从缺口中移除已回答的问题
+                    pending_gaps.discard(current_question)
+
+            # 711
+            elif this_step.action == "reflect" and this_step.questions_to_answer:
+                # ======== 反思动作处理 ========
+                # 1. 对问题进行去重处理
+                this_step.questions_to_answer = choose_k(
+                    (
+                        await dedup_queries(
+                            this_step.questions_to_answer, all_questions, tracker_context
+                        )
+                    )["unique_queries"],
+                    MAX_QUERIES_PER_STEP,
+                )
+                # 入队前统一去除首尾空白，循环中即可直接比较
+                new_gap_questions = [q.strip() for q in this_step.questions_to_answer]
+                this_step.questions_to_answer = new_gap_questions
 
-        # 711
-        elif this_step.action == "reflect" and this_step.questions_to_answer:
-            # ======== 反思动作处理 ========
-            # 1. 对问题进行去重处理
-            this_step.questions_to_answer = choose_k(
-                (
-                    await dedup_queries(
-                        this_step.questions_to_answer, all_questions, tracker_context
+                # 2. 如果有新的子问题，添加到缺口中
+                if new_gap_questions:
+                    diary_context.append(
+                        DIARY_REFLECT_NEW_QUESTIONS_TEMPLATE.format(
+                            step=step,
+                            question=current_question,
+                            subquestions="\n".join(f"- {q}" for q in new_gap_questions),
+                        )
                     )
-                )["unique_queries"],
-                MAX_QUERIES_PER_STEP,
-            )
-            new_gap_questions = this_step.questions_to_answer
-
-            # 2. 如果有新的子问题，添加到缺口中
-            if new_gap_questions:
-                diary_context.append(
-                    DIARY_REFLECT_NEW_QUESTIONS_TEMPLATE.format(
-                        step=step,
-                        question=current_question,
-                        subquestions="\n".join(f"- {q}" for q in new_gap_questions),
+                    gaps.extend(new_gap_questions)
+                    pending_gaps.update(new_gap_questions)
+                    all_questions.extend(new_gap_questions)
+                    step_dict = this_step.model_dump()
+                    update_context({"total_step": total_step, **step_dict})
+                # 3. 如果没有新的子问题，记录到日志
+                else:
+                    diary_context.append(
+                        DIARY_REFLECT_NO_NEW_QUESTIONS_TEMPLATE.format(
+                            step=step,
+                            question=current_question,
+                            gap_questions=", ".join(new_gap_questions),
+                        )
                     )
-                )
-                gaps.extend(new_gap_questions)
-                all_questions.extend(new_gap_questions)
-                update_context({"total_step": total_step, **this_step.dict()})
-            # 3. 如果没有新的子问题，记录到日志
-            else:
-                diary_context.append(
-                    DIARY_REFLECT_NO_NEW_QUESTIONS_TEMPLATE.format(
-                        step=step,
-                        question=current_question,
-                        gap_questions=", ".join(new_gap_questions),
+                    step_dict = this_step.model_dump()
+                    update_context(
+                        {
+                            "total_step": total_step,
+                            **step_dict,
+                            "result": "You have tried all possible questions and found no useful information. You must think out of the box or different angle!!!",
+                        }
                     )
+
+                # 4. 禁用反思动作以防止循环
+                allow_reflect = False
+
+            # 742
+            elif this_step.action == "search" and this_step.search_requests:
+                # ======== 搜索动作处理 ========
+                # 1. 去重和限制搜索请求数量
+                this_step.search_requests = choose_k(
+                    (
+                        await dedup_queries(
+                            this_step.search_requests, [], tracker_context
+                        )
+                    )["unique_queries"],
+                    MAX_QUERIES_PER_STEP,
                 )
-                update_context(
-                    {
-                        "total_step": total_step,
-                        **this_step.dict(),
-                        "result": "You have tried all possible questions and found no useful information. You must think out of the box or different angle!!!",
-                    }
+
+                # 2. 执行第一轮搜索
+                new_knowledge, searched_queries = await execute_search_queries(
+                    [{"q": q} for q in this_step.search_requests],
+                    tracker_context,
+                    all_urls,
+                    json_schema_gen,
                 )
 
-            # 4. 禁用反思动作以防止循环
-            allow_reflect = False
-
-        # 742
-        elif this_step.action == "search" and this_step.search_requests:
-            # ======== 搜索动作处理 ========
-            # 1. 去重和限制搜索请求数量
-            this_step.search_requests = choose_k(
-                (await dedup_queries(this_step.search_requests, [], tracker_context))[
-                    "unique_queries"
-                ],
-                MAX_QUERIES_PER_STEP,
-            )
+                # 3. 记录关键词和知识
+                all_keywords.extend(searched_queries)
+                all_knowledge.extend(new_knowledge)
 
-            # 2. 执行第一轮搜索
-            new_knowledge, searched_queries = await execute_search_queries(
-                [{"q": q} for q in this_step.search_requests],
-                tracker_context,
-                all_urls,
-                json_schema_gen,
-            )
+                # 4. 根据初步结果重写查询
+                sound_bites = " ".join(k.answer for k in new_knowledge)
+                keywords_queries = await rewrite_query(
+                    this_step, sound_bites, tracker_context, json_schema_gen
+                )
+                q_only = [q["q"] for q in keywords_queries if q.get("q")]
 
-            # 3. 记录关键词和知识
-            all_keywords.extend(searched_queries)
-            all_knowledge.extend(new_knowledge)
+                # 5. 去重并避免重复搜索
+                uniq_q_only = choose_k(
+                    (
+                        await dedup_queries(
+                            q_only, all_keywords, tracker_context
+                        )
+                    )["unique_queries"],
+                    MAX_QUERIES_PER_STEP,
+                )
 
-            # 4. 根据初步结果重写查询
-            sound_bites = " ".join(k.answer for k in new_knowledge)
-            keywords_queries = await rewrite_query(
-                this_step, sound_bites, tracker_context, json_schema_gen
-            )
-            q_only = [q["q"] for q in keywords_queries if q.get("q")]
-
-            # 5. 去重并避免重复搜索
-            uniq_q_only = choose_k(
-                (await dedup_queries(q_only, all_keywords, tracker_context))[
-                    "unique_queries"
-                ],
-                MAX_QUERIES_PER_STEP,
-            )
+                # 按查询文本建立索引（保留首次出现的查询项）
+                queries_by_q: Dict[str, Dict[str, Any]] = {}
+                for kq in keywords_queries:
+                    queries_by_q.setdefault(kq.get("q"), kq)
+                keywords_queries = [queries_by_q.get(q, {"q": q}) for q in uniq_q_only]
 
-            keywords_queries = [
-                next((kq for kq in keywords_queries if kq["q"] == q), {"q": q})
-                for q in uniq_q_only
-            ]
+                any_result = False
 
-            any_result = False
+                # 6. 执行第二轮优化搜索(如果有新查询)
+                if keywords_queries:
+                    new_knowledge, searched_queries = await execute_search_queries(
+                        keywords_queries,
+                        tracker_context,
+                        all_urls,
+                        json_schema_gen,
+                        only_hostnames,
+                    )
 
-            # 6. 执行第二轮优化搜索(如果有新查询)
-            if keywords_queries:
-                new_knowledge, searched_queries = await execute_search_queries(
-                    keywords_queries,
-                    tracker_context,
-                    all_urls,
-                    json_schema_gen,
-                    only_hostnames,
-                )
+                    # 如果有结果，记录信息
+                    if searched_queries:
+                        any_result = True
+                        all_keywords.extend(searched_queries)
+                        all_knowledge.extend(new_knowledge)
+
+                        diary_context.append(
+                            DIARY_SEARCH_SUCCESS_TEMPLATE.format(
+                                step=step,
+                                question=current_question,
+                                keywords=", ".join(q["q"] for q in keywords_queries),
+                            )
+                        )
 
-                # 如果有结果，记录信息
-                if searched_queries:
-                    any_result = True
-                    all_keywords.extend(searched_queries)
-                    all_knowledge.extend(new_knowledge)
+                        step_dict = this_step.model_dump()
+                        update_context(
+                            {
+                                "total_step": total_step,
+                                "question": current_question,
+                                **step_dict,
+                                "result": result,
+                            }
+                        )
 
+                # 7. 如果没有结果，记录到日志
+                if not any_result or not keywords_queries:
                     diary_context.append(
-                        DIARY_SEARCH_SUCCESS_TEMPLATE.format(
+                        DIARY_SEARCH_FAIL_TEMPLATE.format(
                             step=step,
                             question=current_question,
                             keywords=", ".join(q["q"] for q in keywords_queries),
                         )
                     )
 
+                    step_dict = this_step.model_dump()
                     update_context(
                         {
                             "total_step": total_step,
-                            "question": current_question,
-                            **this_step.dict(),
-                            "result": result,
+                            **step_dict,
+                            "result": "You have tried all possible queries and found no new information. You must think out of the box or different angle!!!",
                         }
                     )
 
-            # 7. 如果没有结果，记录到日志
-            if not any_result or not keywords_queries:
-                diary_context.append(
-                    DIARY_SEARCH_FAIL_TEMPLATE.format(
-                        step=step,
+                # 8. 禁用搜索动作以防止循环
+                allow_search = False
+
+            # 816
+            elif this_step.action == "visit" and this_step.url_targets and url_list:
+                # ======== 访问URL动作处理 ========
+                # 1. 处理URL目标，确保规范化并去重
+                # normalize_url已缓存结果，这里每个索引只规范化一次
+                candidate_urls = [
+                    normalize_url(url_list[idx - 1])
+                    for idx in this_step.url_targets
+                    if isinstance(idx, int)
+                ]
+                this_step.url_targets = [
+                    url for url in candidate_urls if url and url not in visited_urls_set
+                ]
+
+                # 2. 合并目标URL和优先级URL：先保留显式请求的URL，再按分数顺序补充，
+                #    去重并在达到上限时提前停止；weighted_urls已按分数排好序，
+                #    生成器最多只消费MAX_URLS_PER_STEP个左右的元素
+                merged_urls: List[str] = []
+                seen_urls: Set[str] = set()
+                for url in itertools.chain(
+                    this_step.url_targets, (u.url for u in weighted_urls)
+                ):
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                    merged_urls.append(url)
+                    if len(merged_urls) >= MAX_URLS_PER_STEP:
+                        break
+                this_step.url_targets = merged_urls
+
+                unique_urls = this_step.url_targets
+                if DEBUG:
+                    print("【visit】:", unique_urls)
+
+                # 3. 如果有URL，处理它们
+                if unique_urls:
+                    # 3.1 读取URL内容
+                    visited_len, bad_len = len(visited_urls), len(bad_urls)
+                    process_results = await process_urls(
+                        urls=unique_urls,
+                        tracker_context=tracker_context,
+                        all_knowledge=all_knowledge,
+                        all_urls=all_urls,
+                        visited_urls=visited_urls,
+                        bad_urls=bad_urls,
+                        schema_gen=json_schema_gen,
                         question=current_question,
-                        keywords=", ".join(q["q"] for q in keywords_queries),
                     )
-                )
+                    visited_urls_set.update(visited_urls[visited_len:])
+                    bad_urls_set.update(bad_urls[bad_len:])
+                    url_results = process_results["url_results"]
+                    success = process_results["success"]
 
-                update_context(
-                    {
-                        "total_step": total_step,
-                        **this_step.dict(),
-                        "result": "You have tried all possible queries and found no new information. You must think out of the box or different angle!!!",
-                    }
-                )
-
-            # 8. 禁用搜索动作以防止循环
-            allow_search = False
-
-        # 816
-        elif this_step.action == "visit" and this_step.url_targets and url_list:
-            # ======== 访问URL动作处理 ========
-            # 1. 处理URL目标，确保规范化并去重
-            this_step.url_targets = [
-                normalize_url(url_list[idx - 1])
-                for idx in this_step.url_targets
-                if isinstance(idx, int)
-                and normalize_url(url_list[idx - 1]) not in visited_urls
-            ]
+                    # 3.2 记录结果到日志
+                    diary_context.append(
+                        DIARY_VISIT_SUCCESS_TEMPLATE.format(
+                            step=step, urls="\n".join(str(r.url) for r in url_results)
+                        )
+                        if success
+                        else DIARY_VISIT_FAIL_TEMPLATE.format(step=step)
+                    )
 
-            # 2. 合并目标URL和优先级URL
-            this_step.url_targets = list(
-                set([*this_step.url_targets, *[u.url for u in weighted_urls]])
-            )[:MAX_URLS_PER_STEP]
-
-            unique_urls = this_step.url_targets
-            print("【visit】:", unique_urls)
-
-            # 3. 如果有URL，处理它们
-            if unique_urls:
-                # 3.1 读取URL内容
-                process_results = await process_urls(
-                    urls=unique_urls,
-                    tracker_context=tracker_context,
-                    all_knowledge=all_knowledge,
-                    all_urls=all_urls,
-                    visited_urls=visited_urls,
-                    bad_urls=bad_urls,
-                    schema_gen=json_schema_gen,
-                    question=current_question,
-                )
-                url_results = process_results["url_results"]
-                success = process_results["success"]
+                    # 3.3 更新上下文
+                    step_dict = this_step.model_dump()
+                    update_context(
+                        {
+                            "total_step": total_step,
+                            **(
+                                {
+                                    "question": current_question,
+                                    **step_dict,
+                                    "result": url_results,
+                                }
+                                if success
+                                else {
+                                    **step_dict,
+                                    "result": "You have tried all possible URLs and found no new information. You must think out of the box or different angle!!!",
+                                }
+                            ),
+                        }
+                    )
+                # 4. 如果没有新URL，记录到日志
+                else:
+                    diary_context.append(DIARY_VISIT_NO_NEW_URLS_TEMPLATE.format(step=step))
 
-                # 3.2 记录结果到日志
-                diary_context.append(
-                    DIARY_VISIT_SUCCESS_TEMPLATE.format(
-                        step=step, urls="\n".join(str(r.url) for r in url_results)
+                    step_dict = this_step.model_dump()
+                    update_context(
+                        {
+                            "total_step": total_step,
+                            **step_dict,
+                            "result": "You have visited all possible URLs and found no new information. You must think out of the box or different angle!!!",
+                        }
                     )
-                    if success
-                    else DIARY_VISIT_FAIL_TEMPLATE.format(step=step)
-                )
 
-                # 3.3 更新上下文
-                update_context(
-                    {
-                        "total_step": total_step,
-                        **(
-                            {
-                                "question": current_question,
-                                **this_step.dict(),
-                                "result": url_results,
-                            }
-                            if success
-                            else {
-                                **this_step.dict(),
-                                "result": "You have tried all possible URLs and found no new information. You must think out of the box or different angle!!!",
-                            }
-                        ),
-                    }
-                )
-            # 4. 如果没有新URL，记录到日志
-            else:
-                diary_context.append(DIARY_VISIT_NO_NEW_URLS_TEMPLATE.format(step=step))
+                # 5. 禁用读取动作以防止循环
+                allow_read = False
 
-                update_context(
+            elif this_step.action == "coding" and this_step.coding_issue:
+                # ======== 编码动作处理 ========
+                # 1. 刷新代码沙箱上下文
+                sandbox.update_context(
                     {
-                        "total_step": total_step,
-                        **this_step.dict(),
-                        "result": "You have visited all possible URLs and found no new information. You must think out of the box or different angle!!!",
+                        "all_context": all_context,
+                        "URLs": weighted_urls[:20],
+                        "all_knowledge": all_knowledge,
                     }
                 )
 
-            # 5. 禁用读取动作以防止循环
-            allow_read = False
+                try:
+                    # 2. 尝试解决编码问题
+                    result = await sandbox.solve(this_step.coding_issue)
 
-        elif this_step.action == "coding" and this_step.coding_issue:
-            # ======== 编码动作处理 ========
-            # 1. 初始化代码沙箱
-            sandbox = CodeSandbox(
-                {
-                    "all_context": all_context,
-                    "URLs": weighted_urls[:20],
-                    "all_knowledge": all_knowledge,
-                },
-                tracker_context,
-                json_schema_gen,
-            )
+                    # 3. 将解决方案添加到知识库
+                    all_knowledge.append(
+                        KnowledgeItem(
+                            type="coding",
+                            question=f"What is the solution to the coding issue: {this_step.coding_issue}?",
+                            answer=result.solution.output,
+                            source_code=result.solution.code,
+                            updated=format_date_based_on_type(datetime.now(), "full"),
+                        )
+                    )
 
-            try:
-                # 2. 尝试解决编码问题
-                result = await sandbox.solve(this_step.coding_issue)
-
-                # 3. 将解决方案添加到知识库
-                all_knowledge.append(
-                    KnowledgeItem(
-                        type="coding",
-                        question=f"What is the solution to the coding issue: {this_step.coding_issue}?",
-                        answer=result.solution.output,
-                        source_code=result.solution.code,
-                        updated=format_date_based_on_type(datetime.now(), "full"),
+                    # 4. 记录结果到日志
+                    diary_context.append(
+                        DIARY_CODING_SUCCESS_TEMPLATE.format(
+                            step=step, issue=this_step.coding_issue
+                        )
                     )
-                )
 
-                # 4. 记录结果到日志
-                diary_context.append(
-                    DIARY_CODING_SUCCESS_TEMPLATE.format(
-                        step=step, issue=this_step.coding_issue
+                    # 5. 更新上下文
+                    step_dict = this_step.model_dump()
+                    update_context(
+                        {"total_step": total_step, **step_dict, "result": result}
                     )
-                )
 
-                # 5. 更新上下文
-                update_context(
-                    {"total_step": total_step, **this_step.dict(), "result": result}
-                )
+                except Exception as error:
+                    # 6. 处理错误情况
+                    print("解决编码问题时出错:", error)
+                    diary_context.append(
+                        DIARY_CODING_FAIL_TEMPLATE.format(
+                            step=step, issue=this_step.coding_issue
+                        )
+                    )
 
-            except Exception as error:
-                # 6. 处理错误情况
-                print("解决编码问题时出错:", error)
-                diary_context.append(
-                    DIARY_CODING_FAIL_TEMPLATE.format(
-                        step=step, issue=this_step.coding_issue
+                    step_dict = this_step.model_dump()
+                    update_context(
+                        {
+                            "total_step": total_step,
+                            **step_dict,
+                            "result": "You have tried all possible solutions and found no new information. You must think out of the box or different angle!!!",
+                        }
                     )
-                )
 
-                update_context(
-                    {
-                        "total_step": total_step,
-                        **this_step.dict(),
-                        "result": "You have tried all possible solutions and found no new information. You must think out of the box or different angle!!!",
-                    }
+                finally:
+                    # 7. 禁用编码动作以防止循环
+                    allow_coding = False
+
+            # 写上下文文件不阻塞下一步，积压过多时等待最早的任务完成
+            if len(context_tasks) >= MAX_PENDING_CONTEXT_WRITES:
+                await context_tasks.popleft()
+            context_tasks.append(
+                asyncio.create_task(
+                    store_context(
+                        question,
+                        prompt,
+                        schema,
+                        this_step,
+                        msg_with_knowledge,
+                        total_step,
+                        # 在创建任务前取得快照，后台写入时this_step可能已被下一步替换
+                        step_dict if step_dict is not None else this_step.model_dump(),
+                    )
                 )
+            )
 
-            finally:
-                # 7. 禁用编码动作以防止循环
-                allow_coding = False
-
-        await store_context(
-            question,
-            prompt,
-            schema,
-            this_step,
-            {
-                "all_context": all_context,
-                "all_keywords": all_keywords,
-                "all_questions": all_questions,
-                "all_knowledge": all_knowledge,
-                "weighted_urls": weighted_urls,
-                "msg_with_knowledge": msg_with_knowledge,
-            },
-            total_step,
-        )
-
-        await sleep(STEP_SLEEP)
-
-    # ======== 野兽模式(Beast Mode) ========
-    # 当正常预算耗尽但仍未得到最终答案时激活
-    if "is_final" not in this_step or not this_step.is_final:
-        print("\n" + "=" * 50)
-        print("进入野兽模式!!!")
-        print("=" * 50)
-        step += 1
-        total_step += 1
-
-        # 1. 生成特殊的"野兽模式"提示
-        prompt, _ = get_prompt(
-            context=diary_context,
-            all_keywords=all_keywords,
-            allow_reflect=False,  # 禁用反思
-            allow_answer=False,  # 禁用常规回答
-            allow_read=False,  # 禁用URL读取
-            allow_search=False,  # 禁用搜索
-            allow_coding=False,  # 禁用编码
-            all_urls=all_urls,
-            beast_mode=True,  # 启用野兽模式
-        )
+            # 相邻两步的开始时间至少间隔STEP_SLEEP毫秒；本步耗时已超过该间隔时无需等待
+            remaining_ms = STEP_SLEEP - (time.monotonic() - step_started) * 1000
+            if remaining_ms > 0:
+                await sleep(remaining_ms)
+
+        # ======== 野兽模式(Beast Mode) ========
+        # 当正常预算耗尽但仍未得到最终答案时激活
+        if "is_final" not in this_step or not this_step.is_final:
+            print("\n" + "=" * 50)
+            print("进入野兽模式!!!")
+            print("=" * 50)
+            step += 1
+            total_step += 1
+
+            # 1. 生成特殊的"野兽模式"提示
+            prompt, _ = get_prompt(
+                context=diary_context,
+                all_keywords=all_keywords,
+                allow_reflect=False,  # 禁用反思
+                allow_answer=False,  # 禁用常规回答
+                allow_read=False,  # 禁用URL读取
+                allow_search=False,  # 禁用搜索
+                allow_coding=False,  # 禁用编码
+                all_urls=all_urls,
+                beast_mode=True,  # 启用野兽模式
+            )
 
-        # 2. 准备最终回答的模式和消息
-        schema = json_schema_gen.get_agent_schema(
-            allow_reflect=False,
-            allow_read=False,
-            allow_answer=True,
-            allow_search=False,
-            allow_coding=False,
-            current_question=question,
-        )
-        msg_with_knowledge = compose_msgs(
-            messages, all_knowledge, question, final_answer_pip
-        )
+            # 2. 准备最终回答的模式和消息
+            schema = json_schema_gen.get_agent_schema(
+                allow_reflect=False,
+                allow_read=False,
+                allow_answer=True,
+                allow_search=False,
+                allow_coding=False,
+                current_question=question,
+            )
+            msg_with_knowledge = compose_msgs(
+                messages, all_knowledge, question, final_answer_pip, knowledge_msgs
+            )
 
-        result = await generator.generate_object(
-            {
-                "model": "agentBeastMode",
-                "schema": schema,
-                "system": prompt,
-                "messages": msg_with_knowledge,
-                "numRetries": 2,
-            }
-        )
+            result = await generator.generate_object(
+                {
+                    "model": "agentBeastMode",
+                    "schema": schema,
+                    "system": prompt,
+                    "messages": msg_with_knowledge,
+                    "numRetries": 2,
+                }
+            )
 
-        print(f"【prompt】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{prompt}")
-        print(
-            f"【messages】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{json.dumps(msg_with_knowledge, indent=4, ensure_ascii=False)}"
-        )
+            if DEBUG:
+                # 提示和消息列表随步数增长，序列化和输出开销大且阻塞事件循环，仅在调试时输出
+                print(f"【prompt】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{prompt}")
+                print(
+                    f"【messages】: >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>{dumps_json(msg_with_knowledge)}"
+                )
 
-        this_step = AnswerAction(
-            action=result.object["action"],
-            think=result.object["think"],
-            **result.object[result.object["action"]],
-        )
+            this_step = AnswerAction(
+                action=result.object["action"],
+                think=result.object["think"],
+                **result.object[result.object["action"]],
+            )
 
-        # 4. 更新引用并标记为最终答案
-        await update_references(this_step, all_urls)
-        this_step.is_final = True
+            # 4. 更新引用并标记为最终答案
+            await update_references(this_step, all_urls)
+            this_step.is_final = True
 
-        # 5. 记录动作
-        tracker_context.action_tracker.track_action(
-            {"total_step": total_step, "this_step": this_step, "gaps": gaps}
-        )
+            # 5. 记录动作
+            tracker_context.action_tracker.track_action(
+                {
+                    "total_step": total_step,
+                    "this_step": this_step,
+                    "gaps": [q for q in gaps if q in pending_gaps],
+                }
+            )
 
-        await store_context(
-            question,
-            prompt,
-            schema,
-            this_step,
-            {
-                "all_context": all_context,
-                "all_keywords": all_keywords,
-                "all_questions": all_questions,
-                "all_knowledge": all_knowledge,
-                "weighted_urls": weighted_urls,
-                "msg_with_knowledge": msg_with_knowledge,
-            },
-            total_step,
-        )
+            await store_context(
+                question,
+                prompt,
+                schema,
+                this_step,
+                msg_with_knowledge,
+                total_step,
+            )
+    finally:
+        # 等待所有上下文写入完成，并释放代码沙箱的备用进程；异常退出时同样执行，
+        # 避免遗留未完成的写入任务和独立会话中的解释器进程
+        await asyncio.gather(*context_tasks, return_exceptions=True)
+        await sandbox.close()
 
     # ======== 最终处理 ========
     # 1. 根据问题类型处理Markdown格式
@@ -1348,7 +1557,7 @@ async def get_response(
         "result": this_step,
         "context": tracker_context,
         "visited_urls": [r.url for r in weighted_urls[:num_returned_urls]],
-        "read_urls": [url for url in visited_urls if url not in bad_urls],
+        "read_urls": [url for url in visited_urls if url not in bad_urls_set],
         "all_urls": [r.url for r in weighted_urls],
     }
 
@@ -1358,42 +1567,66 @@ async def store_context(
     prompt: str,
     schema: Any,
     this_step: StepAction,
-    memory: Dict[str, Any],
+    msg_with_knowledge: List[CoreMessage],
     step: int,
+    step_dict: Optional[Dict[str, Any]] = None,
 ) -> None:
+    """将本步的提示、消息、schema和动作写入./context，序列化和写文件在线程中执行
+
+    只传入实际写入的msg_with_knowledge，不再每步组装包含全部会话状态的memory字典
+    """
+    # 在事件循环中取得this_step的快照，避免线程中读取到后续修改
+    if step_dict is None:
+        step_dict = this_step.model_dump()
 
     try:
-        import json
-        from pathlib import Path
-
-        # 写入提示和schema
-        with open(
-            f"./context/prompt-{question[:20]}-{step}.txt", "w", encoding="utf-8"
-        ) as f:
-            f.write(
-                f"""
+        await asyncio.to_thread(
+            _write_context_file,
+            question,
+            prompt,
+            schema,
+            msg_with_knowledge,
+            step_dict,
+            step,
+        )
+    except Exception as error:
+        print("Context storage failed:", error)
+
+
+def _write_context_file(
+    question: str,
+    prompt: str,
+    schema: Any,
+    msg_with_knowledge: List[CoreMessage],
+    step_dict: Dict[str, Any],
+    step: int,
+) -> None:
+    """store_context的同步部分：序列化并写入文件"""
+    # 写入提示和schema
+    with open(
+        f"./context/prompt-{question[:20]}-{step}.txt", "w", encoding="utf-8"
+    ) as f:
+        f.write(
+            f"""
 【Prompt】:
 {prompt}
 
 【message】:
-{json.dumps(memory["msg_with_knowledge"], indent=2, ensure_ascii=False)}
+{dumps_json(msg_with_knowledge)}
 
 【JSONSchema】:
-{json.dumps(schema, indent=2, ensure_ascii=False)}
+{dumps_json(schema)}
 
 【this_step】:
-{json.dumps(this_step.dict(), indent=2, ensure_ascii=False)}
+{dumps_json(step_dict)}
 """
-            )
-
-        # # 写入其他上下文数据
-        # for name, data in memory.items():
-        #     with open(f"{name}.json", "w", encoding="utf-8") as f:
-        #         json.dumps(
-        #             data,
-        #             indent=2,
-        #             default=lambda x: x.dict() if hasattr(x, "dict") else str(x),
-        #         )
+        )
 
-    except Exception as error:
-        print("Context storage failed:", error)
\ No newline at end of file
+    # # 写入其他上下文数据
+    # for name, data in memory.items():
+    #     with open(f"{name}.json", "w", encoding="utf-8") as f:
+    #         json.dumps(
+    #             data,
+    #             indent=2,
+    #             default=lambda x: x.dict() if hasattr(x, "dict") else str(x),
+    #         )
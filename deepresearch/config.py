@@ -5,9 +5,11 @@
 import os
 import json
 import logging
+import functools
 from pathlib import Path
 from typing import Dict, Optional, Any, Union
 
+import orjson
 from dotenv import load_dotenv
 
 MAX_URLS_PER_STEP = 4  # 每个步骤中允许访问的最大URL数量，限制以防止过度抓取和保持效率
@@ -20,8 +22,8 @@ load_dotenv()
 
 # 加载配置文件
 config_path = Path(__file__).parent.parent / "config.json"
-with open(config_path, "r", encoding="utf-8") as f:
-    config_json = json.load(f)
+config_bytes = config_path.read_bytes()
+config_json = orjson.loads(config_bytes)
 
 # 类型定义
 ToolName = str
@@ -53,7 +55,12 @@ except Exception as e:
     print(f"错误: {e}")
     LLM_PROVIDER = "openai"
 
+# 模型配置所在的提供商键（vertex使用gemini的模型配置）
+PROVIDER_KEY = "gemini" if LLM_PROVIDER == "vertex" else LLM_PROVIDER
 
+
+# 以下配置在进程生命周期内不变，结果按工具名缓存；返回的字典被共享，调用方不应修改
+@functools.lru_cache(maxsize=None)
 def get_tool_config(tool_name: str) -> Dict[str, Any]:
     """获取工具配置
 
@@ -63,8 +70,7 @@ def get_tool_config(tool_name: str) -> Dict[str, Any]:
     Returns:
         工具配置
     """
-    provider_key = "gemini" if LLM_PROVIDER == "vertex" else LLM_PROVIDER
-    provider_config = config_json.get("models", {}).get(provider_key, {})
+    provider_config = config_json.get("models", {}).get(PROVIDER_KEY, {})
     default_config = provider_config.get("default", {})
     tool_overrides = provider_config.get("tools", {}).get(tool_name, {})
 
@@ -77,6 +83,7 @@ def get_tool_config(tool_name: str) -> Dict[str, Any]:
     }
 
 
+@functools.lru_cache(maxsize=None)
 def get_max_tokens(tool_name: str) -> int:
     """获取最大令牌数
 
@@ -89,6 +96,7 @@ def get_max_tokens(tool_name: str) -> int:
     return get_tool_config(tool_name).get("max_tokens", 0)
 
 
+@functools.lru_cache(maxsize=None)
 def get_model(tool_name: str):
     """获取模型实例
 
@@ -124,34 +132,60 @@ def get_model(tool_name: str):
     }
 
 
+# 客户端持有HTTP连接池，整个进程共享一个实例以复用keep-alive连接
+@functools.lru_cache(maxsize=None)
+def get_openai_client():
+    """获取共享的OpenAI客户端（首次调用时创建）
+
+    Returns:
+        OpenAI客户端
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_openai_client():
+    """获取共享的AsyncOpenAI客户端（首次调用时创建），请求不阻塞事件循环
+
+    Returns:
+        AsyncOpenAI客户端
+    """
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+
 # 验证必要的环境变量
 if LLM_PROVIDER == "openai" and not OPENAI_API_KEY:
     raise ValueError("未找到 OPENAI_API_KEY")
 if not JINA_API_KEY:
     raise ValueError("未找到 JINA_API_KEY")
 
-# 日志记录所有配置
-config_summary = {
-    "provider": {
-        "name": LLM_PROVIDER,
-        "model": config_json.get("models", {})
-        .get("openai" if LLM_PROVIDER == "openai" else "gemini", {})
-        .get("default", {})
-        .get("model"),
-        **(
-            {"baseUrl": OPENAI_BASE_URL}
-            if LLM_PROVIDER == "openai" and OPENAI_BASE_URL
-            else {}
-        ),
-    },
-    "search": {"provider": SEARCH_PROVIDER},
-    "tools": {
-        name: get_tool_config(name)
-        for name in config_json.get("models", {})
-        .get("gemini" if LLM_PROVIDER == "vertex" else LLM_PROVIDER, {})
-        .get("tools", {})
-    },
-    "defaults": {"stepSleep": STEP_SLEEP},
-}
-
-print("配置摘要:", json.dumps(config_summary, indent=2, ensure_ascii=False))
+# 调试模式下记录所有配置（避免每个worker导入时都打印）
+if DEBUG:
+    config_summary = {
+        "provider": {
+            "name": LLM_PROVIDER,
+            "model": config_json.get("models", {})
+            .get("openai" if LLM_PROVIDER == "openai" else "gemini", {})
+            .get("default", {})
+            .get("model"),
+            **(
+                {"baseUrl": OPENAI_BASE_URL}
+                if LLM_PROVIDER == "openai" and OPENAI_BASE_URL
+                else {}
+            ),
+        },
+        "search": {"provider": SEARCH_PROVIDER},
+        "tools": {
+            name: get_tool_config(name)
+            for name in config_json.get("models", {})
+            .get(PROVIDER_KEY, {})
+            .get("tools", {})
+        },
+        "defaults": {"stepSleep": STEP_SLEEP},
+    }
+
+    print("配置摘要:", json.dumps(config_summary, indent=2, ensure_ascii=False))
@@ -1,12 +1,16 @@
 
+import functools
 from enum import Enum
-from typing import List, Dict, Optional, Tuple, Union, TypedDict, Any, Literal
-from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Tuple, Union, TypedDict, Any, Literal, TYPE_CHECKING
+from pydantic import BaseModel, ConfigDict, Field
 
 # 添加 TokenTracker 和 ActionTracker 的导入
 from .utils.token_tracker import TokenTracker
 from .utils.action_tracker import ActionTracker
 
+if TYPE_CHECKING:
+    from .utils.safe_generator import ObjectGeneratorSafe
+
 
 class BaseAction(BaseModel):
     """基础动作类型"""
@@ -180,6 +184,8 @@ class ReadResponse(BaseModel):
 class EvaluationResponse(BaseModel):
     """评估响应"""
 
+    model_config = ConfigDict(populate_by_name=True)
+
     pass_eval: bool = Field(..., alias="pass")
     think: str
     type: Optional[EvaluationType] = None
@@ -350,6 +356,13 @@ class TrackerContext(BaseModel):
 
     model_config = {"arbitrary_types_allowed": True}
 
+    @functools.cached_property
+    def generator(self) -> "ObjectGeneratorSafe":
+        """与token_tracker绑定的共享安全生成器，首次访问时创建，避免每次评估都重新构造"""
+        from .utils.safe_generator import ObjectGeneratorSafe
+
+        return ObjectGeneratorSafe(self.token_tracker)
+
 
 class PDFReadResponse(BaseModel):
     """PDF阅读响应"""
@@ -221,6 +221,16 @@ BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE = """
 
 这些污渍之间的原始文本是什么？"""
 
+BROKEN_CH_FIXER_DOCUMENT_SYSTEM_PROMPT = """
+你正在帮助修复一个损坏的扫描的markdown文档，文档中有些地方被污渍（用�表示）污染了。
+用户消息是整篇文档。把每一段连续的�符号替换为最可能的原始文本。
+
+规则：
+1. 只输出完整的文档 - 不要解释，不要代码块标记
+2. 污渍以外的每个字符（包括空白和换行）都必须原样保留
+3. 每处替换的长度要与该处污渍的长度相称
+4. 考虑文档似乎是中文，如果是中文，请用中文回答。"""
+
 
 ERROR_ANALYZER_SYSTEM_PROMPT_TEMPLATE = """
 你是一个专家，擅长分析搜索和推理过程。你的任务是分析给定的步骤序列，并确定搜索过程中出了什么问题。
@@ -342,8 +352,6 @@ QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE = """
 你是一个专家级的搜索查询扩展专家，具有深入的心理学理解。
 你通过广泛分析潜在的用户意图并生成全面的查询变体来优化用户查询。
 
-当前时间：{current_time}。当前年份：{current_year}，当前月份：{current_month}。
-
 <intent-mining>
 为了揭示每个查询背后最深层次的用户意图，通过这些渐进的层次进行分析：
 
@@ -523,6 +531,8 @@ queries: [
 </examples>
 
 每个生成的查询必须遵循JSON schema格式。
+
+当前时间：{current_time}。当前年份：{current_year}，当前月份：{current_month}。
 """
 
 QUERY_REWRITER_USER_PROMPT_TEMPLATE = """
@@ -653,7 +663,7 @@ DEFINITIVE_USER_PROMPT = """
 答案：{answer}"""
 
 FRESHNESS_SYSTEM_PROMPT = """
-你是一个评估者，负责分析答案内容是否可能过时，基于提到的日期（或隐含的日期时间）与当前系统时间：{current_time}
+你是一个评估者，负责分析答案内容是否可能过时，基于提到的日期（或隐含的日期时间）与当前系统时间（见末尾）
 
 <rules>  
 **问题-答案时效性检查指南**
@@ -704,7 +714,9 @@ FRESHNESS_SYSTEM_PROMPT = """
 4. **来源可靠性**：结合来源可靠性评分来更好地评估质量。
 5. **领域特殊性**：某些专门领域（如疫情期间的医学研究、市场波动中的财务数据）可能需要动态调整阈值。
 6. **地域相关性**：地区性因素可能会改变本地法规或事件的时效要求。  
-</rules>"""
+</rules>
+
+当前系统时间：{current_time}"""
 
 FRESHNESS_USER_PROMPT = """
 问题：{question}
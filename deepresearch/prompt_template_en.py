@@ -209,6 +209,15 @@ On the right of the stains: "{right_context}"
 
 So what was the original text between these two contexts?"""
 
+BROKEN_CH_FIXER_DOCUMENT_SYSTEM_PROMPT = """You're helping fix a corrupted scanned markdown document that has stains (represented by �).
+The user message is the whole document. Replace every run of consecutive � symbols with the original text that most likely stood there.
+
+Rules:
+1. Output the full document and nothing else - no explanations, no code fences
+2. Copy every character outside the stains exactly as it is, including whitespace and line breaks
+3. Keep each replacement appropriate to the length of its unknown sequence
+4. Consider the document appears to be in Chinese if that's what the context suggests"""
+
 
 ERROR_ANALYZER_SYSTEM_PROMPT_TEMPLATE = """You are an expert at analyzing search and reasoning processes. Your task is to analyze the given sequence of steps and identify what went wrong in the search process.
 
@@ -324,8 +333,6 @@ QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE = """
 You are an expert search query expander with deep psychological understanding.
 You optimize user queries by extensively analyzing potential user intents and generating comprehensive query variations.
 
-The current time is {current_time}. Current year: {current_year}, current month: {current_month}.
-
 <intent-mining>
 To uncover the deepest user intent behind every query, analyze through these progressive layers:
 
@@ -511,6 +518,8 @@ queries: [
 </examples>
 
 Each generated query must follow JSON schema format.
+
+The current time is {current_time}. Current year: {current_year}, current month: {current_month}.
 """
 
 QUERY_REWRITER_USER_PROMPT_TEMPLATE = """
@@ -660,7 +669,7 @@ DEFINITIVE_USER_PROMPT = """
 Question: {question}
 Answer: {answer}"""
 FRESHNESS_SYSTEM_PROMPT = """
-You are an evaluator that analyzes if answer content is likely outdated based on mentioned dates (or implied datetime) and current system time: {current_time}
+You are an evaluator that analyzes if answer content is likely outdated based on mentioned dates (or implied datetime) and current system time (given at the end)
 
 <rules>
 Question-Answer Freshness Checker Guidelines
@@ -711,7 +720,9 @@ Question-Answer Freshness Checker Guidelines
 4. **Source Reliability**: Pair freshness metrics with source credibility scores for better quality assessment.
 5. **Domain Specificity**: Some specialized fields (medical research during pandemics, financial data during market volatility) may require dynamically adjusted thresholds.
 6. **Geographic Relevance**: Regional considerations may alter freshness requirements for local regulations or events.
-</rules>"""
+</rules>
+
+Current system time: {current_time}"""
 FRESHNESS_USER_PROMPT = """
 Question: {question}
 Answer: 
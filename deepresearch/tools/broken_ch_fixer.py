@@ -1,28 +1,216 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
 import sys
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple
 
 # 确保项目根目录在Python路径中
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 try:
-    from openai import OpenAI
     from ..model_types import TrackerContext, PromptPair
-    from ..utils.text_tools import detect_broken_unicode_via_file_io
-    from ..config import OPENAI_API_KEY, OPENAI_BASE_URL, get_model
+    from ..utils.text_tools import detect_broken_unicode_via_file_io, PrecompiledTemplate
+    from ..config import get_model, get_async_openai_client, DEBUG
     from ..utils.action_tracker import ActionTracker
     from ..utils.token_tracker import TokenTracker
-    from ..prompt_template_en import BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE, BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE
+    from ..prompt_template_en import (
+        BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE,
+        BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE,
+        BROKEN_CH_FIXER_DOCUMENT_SYSTEM_PROMPT,
+    )
 except ImportError:
-    from openai import OpenAI
     from deepresearch.model_types import TrackerContext, PromptPair
-    from deepresearch.utils.text_tools import detect_broken_unicode_via_file_io
-    from deepresearch.config import OPENAI_API_KEY, OPENAI_BASE_URL, get_model
+    from deepresearch.utils.text_tools import detect_broken_unicode_via_file_io, PrecompiledTemplate
+    from deepresearch.config import get_model, get_async_openai_client, DEBUG
     from deepresearch.utils.action_tracker import ActionTracker
     from deepresearch.utils.token_tracker import TokenTracker
-    from deepresearch.prompt_template_en import BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE, BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE
+    from deepresearch.prompt_template_en import (
+        BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE,
+        BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE,
+        BROKEN_CH_FIXER_DOCUMENT_SYSTEM_PROMPT,
+    )
+
+# 逐段修复按批并发请求；连续无效的段超过MAX_CONSECUTIVE_SKIPS时停止请求，
+# 每出现无效结果，后续只尝试更长的破损段，避免病态输入浪费请求
+REPAIR_BATCH_SIZE = 5
+MAX_CONSECUTIVE_SKIPS = 3
+# 连续的Unicode替换字符（U+FFFD）段，由正则引擎一次扫描得到每段的起点和长度
+_REPLACEMENT_RUN_RE = re.compile("\ufffd+")
+
+# 破损段两侧上下文最多取MAX_CONTEXT_CHARS个字符，遇到句子边界提前截止，但至少保留MIN_CONTEXT_CHARS个字符
+MAX_CONTEXT_CHARS = 100
+MIN_CONTEXT_CHARS = 20
+_SENTENCE_BOUNDARY_RE = re.compile(r"[\n。！？.!?]")
+
+# 文档不超过该长度且破损段不止一处时，先尝试一次请求修复整篇文档
+MAX_WHOLE_DOC_CHARS = 8000
+
+MAX_HOLE_CACHE_SIZE = 10000  # 进程内缓存的修复结果条数上限
+# 以(字符数, 左上下文, 右上下文)的哈希为键缓存有效的修复结果，重复出现的破损段不再请求模型
+_HOLE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+
+# 按文档记录上次运行各段的修复结果，文档小幅修改后重新处理时复用上下文未变的段
+HOLE_LOG_DIR = Path.home() / ".cache" / "broken_ch_fixer"
+MAX_HOLE_LOG_BYTES = 16 * 1024 * 1024  # 修复记录目录的容量上限，超过时按修改时间淘汰最旧的记录
+DOC_ID_PREFIX_CHARS = 256  # 用文档开头这些字符的哈希标识同一篇文档
+STEP_CONTEXT_CHARS = 32  # 比较段是否变化时使用的两侧上下文长度
+
+# 提示模板导入时预先解析
+BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE = PrecompiledTemplate(BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE)
+
+
+def _blake2b_hex(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def _hole_key(unknown_count: int, left_context: str, right_context: str) -> str:
+    """破损段的内容寻址键"""
+    return _blake2b_hex(f"{unknown_count}|{left_context}|{right_context}")
+
+
+def _hole_log_path(text: str) -> Path:
+    """文档对应的修复记录文件，以文档开头的哈希命名，局部修改后仍能找到"""
+    return HOLE_LOG_DIR / f"{_blake2b_hex(text[:DOC_ID_PREFIX_CHARS])}.json"
+
+
+def _step_key(unknown_count: int, left_context: str, right_context: str) -> str:
+    """只取紧邻破损段的上下文计算键，远处的修改不影响复用"""
+    return _blake2b_hex(
+        left_context[-STEP_CONTEXT_CHARS:] + right_context[:STEP_CONTEXT_CHARS] + str(unknown_count)
+    )
+
+
+def _load_hole_log(path: Path) -> Dict[str, str]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _save_hole_log(path: Path, log: Dict[str, str]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(log, ensure_ascii=False), encoding="utf-8")
+    except OSError as error:
+        print("保存修复记录失败:", error)
+        return
+    _evict_hole_logs(path.parent)
+
+
+def _evict_hole_logs(log_dir: Path) -> None:
+    """修复记录目录超过容量上限时，按修改时间淘汰最旧的记录"""
+    try:
+        stats = []
+        for entry in os.scandir(log_dir):
+            if entry.is_file():
+                st = entry.stat()
+                stats.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    total_size = sum(size for _, size, _ in stats)
+    if total_size <= MAX_HOLE_LOG_BYTES:
+        return
+
+    for _, size, path in sorted(stats):
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            continue
+        if total_size <= MAX_HOLE_LOG_BYTES:
+            break
+
+
+def _cache_hole(key: str, replacement: str) -> None:
+    """写入进程内修复缓存，超过MAX_HOLE_CACHE_SIZE时淘汰最久未使用的条目"""
+    _HOLE_CACHE[key] = replacement
+    _HOLE_CACHE.move_to_end(key)
+    if len(_HOLE_CACHE) > MAX_HOLE_CACHE_SIZE:
+        _HOLE_CACHE.popitem(last=False)
+
+
+def _has_broken_unicode(text: str) -> bool:
+    """在内存中检查文本是否含有替换字符或无法编码为UTF-8的字符（如孤立代理项）
+
+    模型返回的已是解码后的str，不需要像整篇文档那样经过临时文件读写检测
+    """
+    if "\ufffd" in text:
+        return True
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return True
+    return False
+
+
+def _trim_to_boundary(text: str, from_end: bool) -> str:
+    """把上下文截到离破损段最近的句子边界，减少每段的提示长度
+
+    Args:
+        text: 最多MAX_CONTEXT_CHARS个字符的上下文
+        from_end: True表示左侧上下文（破损段在末尾），False表示右侧上下文（破损段在开头）
+    """
+    if len(text) <= MIN_CONTEXT_CHARS:
+        return text
+    if from_end:
+        # 最靠近末尾、且距末尾至少MIN_CONTEXT_CHARS的边界之后的部分
+        cut = None
+        for match in _SENTENCE_BOUNDARY_RE.finditer(text, 0, len(text) - MIN_CONTEXT_CHARS):
+            cut = match.end()
+        return text if cut is None else text[cut:]
+    match = _SENTENCE_BOUNDARY_RE.search(text, MIN_CONTEXT_CHARS)
+    return text if match is None else text[: match.end()]
+
+
+def _fast_broken_check(text: str) -> Dict[str, Any]:
+    """在内存中完成与detect_broken_unicode_via_file_io相同的检测
+
+    文本模式写入再读回的效果只有两点：换行符统一为\n，以及无法编码为UTF-8的内容写入失败
+    （此时该函数按未破损处理并返回原文），这里直接在内存中复现，不再经过临时文件
+    """
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return {"broken": False, "read_str": text}
+    read_str = text.replace("\r\n", "\n").replace("\r", "\n")
+    return {"broken": "\ufffd" in read_str, "read_str": read_str}
+
 
+def _matches_anchors(original: str, repaired: str) -> bool:
+    """检查整篇修复结果是否只改动了�字符段
 
+    破损段之外的文本按顺序原样出现在结果中，每处替换非空且不超过该段字符数的4倍
+    （与逐段修复的校验一致），结果中不再有破损字符
+    """
+    if _has_broken_unicode(repaired):
+        return False
+
+    segments = _REPLACEMENT_RUN_RE.split(original)
+    counts = [len(run) for run in _REPLACEMENT_RUN_RE.findall(original)]
+    if not repaired.startswith(segments[0]):
+        return False
+
+    cursor = len(segments[0])
+    for unknown_count, segment in zip(counts, segments[1:]):
+        if segment:
+            # 替换文本之后紧接着下一段原文，取允许范围内最早的匹配位置
+            found = repaired.find(segment, cursor + 1, cursor + unknown_count * 4 + len(segment))
+            if found == -1:
+                return False
+        else:
+            # 文档以破损段结尾，剩余部分就是替换文本
+            found = len(repaired)
+            if not cursor < found <= cursor + unknown_count * 4:
+                return False
+        cursor = found + len(segment)
+
+    return cursor == len(repaired)
 
 
 def get_prompt(unknown_count: int, left_context: str, right_context: str) -> PromptPair:
@@ -37,27 +225,32 @@ def get_prompt(unknown_count: int, left_context: str, right_context: str) -> Pro
     Returns:
         包含系统提示和用户提示的PromptPair对象
     """
-    # 格式化系统提示
-    system_prompt = BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE
-
-    # 格式化用户提示
+    # 系统提示没有占位符，直接使用；用户提示由预编译模板拼接
     user_prompt = BROKEN_CH_FIXER_USER_PROMPT_TEMPLATE.format(
         unknown_count=unknown_count,
         left_context=left_context,
         right_context=right_context,
     )
 
-    return PromptPair(system=system_prompt, user=user_prompt)
+    # 字段都是刚生成的str，用model_construct跳过逐段重复的校验
+    return PromptPair.model_construct(system=BROKEN_CH_FIXER_SYSTEM_PROMPT_TEMPLATE, user=user_prompt)
 
 
 async def repair_unknown_chars(
-    md_content: str, trackers: Optional[TrackerContext] = None
+    md_content: str,
+    trackers: Optional[TrackerContext] = None,
+    force_full_check: bool = False,
 ) -> str:
     """
     修复包含�字符的markdown内容，使用AI模型猜测缺失的文本
+
+    破损字符检测在内存中完成；force_full_check为True时仍经过临时文件读写检测
     """
     # 检测是否有破损的Unicode字符
-    broken_result = await detect_broken_unicode_via_file_io(md_content)
+    if force_full_check:
+        broken_result = await detect_broken_unicode_via_file_io(md_content)
+    else:
+        broken_result = _fast_broken_check(md_content)
     broken = broken_result.get("broken", False)
     read_str = broken_result.get("read_str", md_content)
 
@@ -65,58 +258,33 @@ async def repair_unknown_chars(
     if not broken:
         return read_str
 
-    print("检测到输出中有破损的Unicode字符，尝试修复...")
-
-    repaired_content = read_str
-    remaining_unknowns = True
-    iterations = 0
+    if DEBUG:
+        print("检测到输出中有破损的Unicode字符，尝试修复...")
 
-    last_position = -1
-    client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    # 一次扫描找出所有连续的�字符段的起点和长度
+    holes = [
+        (match.start(), match.end() - match.start())
+        for match in _REPLACEMENT_RUN_RE.finditer(read_str)
+    ]
 
-    # 循环修复所有破损字符
-    while remaining_unknowns and iterations < 20:
-        iterations += 1
-
-        # 查找第一个�字符的位置
-        position = repaired_content.find("�")
-        if position == -1:
-            remaining_unknowns = False
-            continue
+    # 读取上次处理该文档时的修复记录
+    log_path = _hole_log_path(read_str)
+    previous_log = await asyncio.to_thread(_load_hole_log, log_path)
 
-        # 检查是否在同一位置卡住
-        if position == last_position:
-            # 通过删除字符跳过此位置
-            repaired_content = (
-                repaired_content[:position] + repaired_content[position + 1 :]
-            )
-            continue
+    client = get_async_openai_client()
+    # 所有段共用同一个模型，只解析一次配置
+    model_name = get_model("fallback")["model"]
 
-        # 更新上一个位置以检测循环
-        last_position = position
-
-        # 计算连续的�字符数量
-        unknown_count = 0
-        for i in range(position, len(repaired_content)):
-            if repaired_content[i] == "�":
-                unknown_count += 1
-            else:
-                break
-
-        # 提取未知字符周围的上下文
-        context_size = 100
-        start = max(0, position - context_size)
-        end = min(len(repaired_content), position + unknown_count + context_size)
-        left_context = repaired_content[start:position]
-        right_context = repaired_content[position + unknown_count : end]
-
-        # 让AI模型猜测缺失的字符
+    async def repair_hole(
+        position: int, unknown_count: int, left_context: str, right_context: str
+    ) -> Optional[str]:
+        """让AI模型猜测一段�字符对应的原文，无效时返回None"""
         try:
             # 获取提示
             prompt = get_prompt(unknown_count, left_context, right_context)
 
-            result = client.chat.completions.create(
-                model=get_model("fallback")["model"],
+            result = await client.chat.completions.create(
+                model=model_name,
                 messages=[
                     {"role": "system", "content": prompt.system},
                     {"role": "user", "content": prompt.user},
@@ -139,35 +307,137 @@ async def repair_unknown_chars(
             # 验证替换文本
             if (
                 replacement == "UNKNOWN"
-                or (await detect_broken_unicode_via_file_io(replacement)).get(
-                    "broken", False
-                )
+                or _has_broken_unicode(replacement)
                 or len(replacement) > unknown_count * 4
             ):
-                print(f"跳过位置{position}处的无效替换 {replacement}")
-                # 不修改内容，跳到下一个�字符
-            else:
-                # 用生成的文本替换未知序列
-                repaired_content = (
-                    repaired_content[:position]
-                    + replacement
-                    + repaired_content[position + unknown_count :]
-                )
+                if DEBUG:
+                    print(f"跳过位置{position}处的无效替换 {replacement}")
+                return None
 
-            print(
-                f'修复迭代{iterations}：将{unknown_count}个�字符替换为"{replacement}"'
-            )
+            if DEBUG:
+                print(f'修复位置{position}：将{unknown_count}个�字符替换为"{replacement}"')
+            return replacement
 
         except Exception as error:
             print("修复未知字符时出错:", error)
-            # 不修改此字符，跳到下一个�字符
+            # 不修改此字符段
+            return None
+
+    # 提取每段周围的上下文并计算缓存键；上次运行中紧邻上下文未变的段和命中缓存的段直接复用，
+    # 同一文档中上下文相同的段只请求一次
+    hole_keys: List[str] = []
+    step_keys: List[str] = []
+    pending: Dict[str, Any] = {}
+    reused = 0
+    for position, unknown_count in holes:
+        start = max(0, position - MAX_CONTEXT_CHARS)
+        end = min(len(read_str), position + unknown_count + MAX_CONTEXT_CHARS)
+        left_context = _trim_to_boundary(read_str[start:position], True)
+        right_context = _trim_to_boundary(read_str[position + unknown_count : end], False)
+        key = _hole_key(unknown_count, left_context, right_context)
+        step_key = _step_key(unknown_count, left_context, right_context)
+        hole_keys.append(key)
+        step_keys.append(step_key)
+
+        previous = previous_log.get(step_key)
+        if isinstance(previous, str) and previous and not _has_broken_unicode(previous):
+            _cache_hole(key, previous)
+            reused += 1
+        elif key not in _HOLE_CACHE and key not in pending:
+            pending[key] = (position, unknown_count, left_context, right_context)
+
+    # 复用后仍有多段待修复的短文档先整篇修复一次，一次请求代替逐段请求；
+    # 结果未通过锚点校验时回退到逐段修复
+    if len(pending) > 1 and len(read_str) <= MAX_WHOLE_DOC_CHARS:
+        try:
+            result = await client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": BROKEN_CH_FIXER_DOCUMENT_SYSTEM_PROMPT},
+                    {"role": "user", "content": read_str},
+                ],
+            )
+
+            if trackers and trackers.token_tracker:
+                trackers.token_tracker.track_usage(
+                    "md-fixer",
+                    {
+                        "prompt_tokens": result.usage.prompt_tokens,
+                        "completion_tokens": result.usage.completion_tokens,
+                        "total_tokens": result.usage.total_tokens,
+                    },
+                )
+
+            repaired_doc = result.choices[0].message.content or ""
+            if _matches_anchors(read_str, repaired_doc):
+                if DEBUG:
+                    print(f"整篇修复成功：一次请求修复了{len(_REPLACEMENT_RUN_RE.findall(read_str))}段")
+                return repaired_doc
+            if DEBUG:
+                print("整篇修复结果改动了破损段以外的文本，改为逐段修复")
 
-    return repaired_content
+        except Exception as error:
+            print("整篇修复未知字符时出错:", error)
+
+    # 各段的修复请求互不依赖，按批并发发出；根据已完成批次的结果决定是否继续
+    pending_args = list(pending.items())
+    consecutive_skips = 0
+    min_hole_chars = 1
+    index = 0
+    while index < len(pending_args) and consecutive_skips <= MAX_CONSECUTIVE_SKIPS:
+        batch = []
+        while index < len(pending_args) and len(batch) < REPAIR_BATCH_SIZE:
+            key, args = pending_args[index]
+            index += 1
+            if args[1] >= min_hole_chars:
+                batch.append((key, args))
+
+        results = await asyncio.gather(*(repair_hole(*args) for _, args in batch))
+        for (key, _), replacement in zip(batch, results):
+            if replacement is None:
+                consecutive_skips += 1
+                continue
+            consecutive_skips = 0
+            _cache_hole(key, replacement)
+
+        if None in results:
+            min_hole_chars *= 2
+
+    if DEBUG and index < len(pending_args):
+        print(f"连续{consecutive_skips}段修复无效，停止修复剩余{len(pending_args) - index}段")
+
+    replacements: List[Optional[str]] = []
+    current_log: Dict[str, str] = {}
+    for key, step_key in zip(hole_keys, step_keys):
+        replacement = _HOLE_CACHE.get(key)
+        if replacement is not None:
+            _HOLE_CACHE.move_to_end(key)
+            current_log[step_key] = replacement
+        replacements.append(replacement)
+
+    if DEBUG:
+        repaired = sum(replacement is not None for replacement in replacements)
+        print(f"破损字符修复：共{len(holes)}段，修复{repaired}段（复用上次运行{reused}段），跳过{len(holes) - repaired}段")
+
+    if current_log and current_log != previous_log:
+        await asyncio.to_thread(_save_hole_log, log_path, current_log)
+
+    # 按位置顺序一次拼接所有片段和替换文本，避免每个替换都重建整篇字符串；
+    # 无效替换保留原来的�字符
+    parts: List[str] = []
+    cursor = 0
+    for (position, unknown_count), replacement in zip(holes, replacements):
+        if replacement is None:
+            continue
+        parts.append(read_str[cursor:position])
+        parts.append(replacement)
+        cursor = position + unknown_count
+    parts.append(read_str[cursor:])
 
+    return "".join(parts)
 
-if __name__ == "__main__":
-    import asyncio
 
+if __name__ == "__main__":
     async def test_repair_chars():
         # 创建测试数据
         test_content = """在 Qwen2 发布后的过去三个月里，许多���基于 Qwen2 语言模型构建了新的模型，并为我们提供了宝贵的反馈。在这段时间里，我们专注于创建更智能、更博学的语言模型。今天，我们很高兴地向大家介绍 Qwen 家族的最新成员：Qwen2.5。
@@ -2,8 +2,12 @@
 代码沙箱工具 - 安全执行代码并返回结果
 """
 import asyncio
+import collections
+import hashlib
 import os
 import re
+import shutil
+import signal
 import subprocess
 import tempfile
 from typing import Dict, Any, List, Optional, Tuple
@@ -11,7 +15,144 @@ import uuid
 import json
 
 from ..model_types import CodeGenResponse
-from ..config import OPENAI_API_KEY, OPENAI_API_MODEL, ALLOWED_CODING_LANGUAGES, DEBUG
+from ..config import OPENAI_API_KEY, OPENAI_API_MODEL, ALLOWED_CODING_LANGUAGES, DEBUG, get_openai_client
+
+# 匹配Markdown代码块（可带语言标记）
+_CODE_BLOCK_RE = re.compile(r'```(?:\w*\n)?([\s\S]*?)```')
+
+# 编译产物缓存目录（按源码哈希命名）及其容量上限
+BUILD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sandbox")
+MAX_BUILD_CACHE_BYTES = 256 * 1024 * 1024
+
+# 每种解释型语言预先启动、等待从标准输入读取代码的进程数
+WARM_POOL_SIZE = 1
+
+# 子进程输出只保留开头和结尾各一段，防止失控的输出循环占满内存
+OUTPUT_HEAD_BYTES = 256 * 1024
+OUTPUT_TAIL_BYTES = 256 * 1024
+OUTPUT_READ_CHUNK = 64 * 1024
+
+
+def _write_tmp_source(code: str, ext: str) -> str:
+    """
+    将代码写入唯一命名的临时源文件
+    
+    go run和ts-node依赖文件扩展名识别源码，无法使用无路径的O_TMPFILE，
+    这里以O_EXCL独占创建并用一次os.write写入，减少系统调用
+    
+    Args:
+        code: 源代码
+        ext: 文件扩展名
+        
+    Returns:
+        临时文件路径
+    """
+    file_path = os.path.join(tempfile.gettempdir(), f"sandbox_{uuid.uuid4()}{ext}")
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+    fd = os.open(file_path, flags, 0o600)
+    try:
+        os.write(fd, code.encode("utf-8"))
+    finally:
+        os.close(fd)
+    return file_path
+
+
+async def _read_bounded(stream: asyncio.StreamReader) -> str:
+    """
+    分块读取子进程输出，超出预算时丢弃中间部分
+    
+    Args:
+        stream: 子进程的stdout或stderr
+        
+    Returns:
+        解码后的输出，中间被丢弃时插入截断说明
+    """
+    head = bytearray()
+    tail: collections.deque = collections.deque()
+    tail_size = 0
+    dropped = 0
+    
+    while True:
+        chunk = await stream.read(OUTPUT_READ_CHUNK)
+        if not chunk:
+            break
+            
+        if len(head) < OUTPUT_HEAD_BYTES:
+            take = OUTPUT_HEAD_BYTES - len(head)
+            head += chunk[:take]
+            chunk = chunk[take:]
+            if not chunk:
+                continue
+                
+        tail.append(chunk)
+        tail_size += len(chunk)
+        while tail_size > OUTPUT_TAIL_BYTES:
+            excess = tail_size - OUTPUT_TAIL_BYTES
+            first = tail[0]
+            if len(first) <= excess:
+                tail.popleft()
+                dropped += len(first)
+                tail_size -= len(first)
+            else:
+                tail[0] = first[excess:]
+                dropped += excess
+                tail_size -= excess
+                
+    if not dropped:
+        return (bytes(head) + b"".join(tail)).decode('utf-8', errors='replace')
+        
+    return (
+        head.decode('utf-8', errors='replace')
+        + f"\n...[输出过长，已省略中间{dropped}字节]...\n"
+        + b"".join(tail).decode('utf-8', errors='replace')
+    )
+
+
+async def _communicate_bounded(
+    process: asyncio.subprocess.Process, stdin_data: Optional[bytes]
+) -> Tuple[str, str]:
+    """
+    写入标准输入并读取有界的stdout/stderr，直到子进程退出
+    
+    Args:
+        process: 子进程
+        stdin_data: 写入标准输入的数据，None表示不写入
+        
+    Returns:
+        (stdout, stderr)
+    """
+    readers = asyncio.gather(_read_bounded(process.stdout), _read_bounded(process.stderr))
+    try:
+        if stdin_data is not None:
+            try:
+                process.stdin.write(stdin_data)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # 子进程未读完代码就已退出，错误信息在stderr中
+                pass
+            process.stdin.close()
+            
+        stdout_str, stderr_str = await readers
+        await process.wait()
+        return stdout_str, stderr_str
+    finally:
+        if not readers.done():
+            readers.cancel()
+
+
+def _remove_quietly(path: Optional[str]) -> None:
+    """
+    删除文件，文件不存在时忽略
+    
+    Args:
+        path: 文件路径
+    """
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 
 class CodeSandbox:
@@ -19,38 +160,152 @@ class CodeSandbox:
     代码沙箱 - 用于安全执行代码
     """
     
-    def __init__(self):
-        # 支持的语言和对应的执行命令
-        self.language_configs = {
-            "python": {
-                "file_ext": ".py",
-                "run_cmd": ["python", "{file}"]
-            },
-            "javascript": {
-                "file_ext": ".js",
-                "run_cmd": ["node", "{file}"]
-            },
-            "typescript": {
-                "file_ext": ".ts",
-                "run_cmd": ["npx", "ts-node", "{file}"]
-            },
-            "bash": {
-                "file_ext": ".sh",
-                "run_cmd": ["bash", "{file}"]
-            },
-            "go": {
-                "file_ext": ".go",
-                "run_cmd": ["go", "run", "{file}"]
-            },
-            "ruby": {
-                "file_ext": ".rb",
-                "run_cmd": ["ruby", "{file}"]
-            },
-            "php": {
-                "file_ext": ".php",
-                "run_cmd": ["php", "{file}"]
-            }
+    # 支持的语言和对应的执行命令（所有实例共享，不随实例重建）；
+    # 配置了stdin_cmd的解释器直接从标准输入读取代码，无需写临时文件（bash -s会边读边执行，
+    # 用户代码中读取标准输入的命令会吞掉剩余脚本，因此bash仍使用临时文件）；
+    # 配置了build_cmd的语言在编译器可用时按源码哈希缓存编译产物，相同代码只编译一次；
+    # 配置了warm的解释器提前启动备用进程，执行时只需写入代码，省去解释器启动耗时
+    language_configs: Dict[str, Dict[str, Any]] = {
+        "python": {
+            "file_ext": ".py",
+            "run_cmd": ["python", "{file}"],
+            "stdin_cmd": ["python", "-"],
+            "warm": True
+        },
+        "javascript": {
+            "file_ext": ".js",
+            "run_cmd": ["node", "{file}"],
+            "stdin_cmd": ["node", "-"],
+            "warm": True
+        },
+        "typescript": {
+            "file_ext": ".ts",
+            "run_cmd": ["npx", "ts-node", "{file}"],
+            # esbuild只转译不做类型检查（与ts-node不同，含类型错误的代码也会运行）；
+            # 输出CommonJS，与ts-node的默认行为一致，不依赖Node的模块语法检测
+            "build_cmd": ["esbuild", "{file}", "--outfile={output}", "--platform=node", "--format=cjs", "--log-level=error"],
+            "build_ext": ".js",
+            "cached_run_cmd": ["node", "{output}"]
+        },
+        "bash": {
+            "file_ext": ".sh",
+            "run_cmd": ["bash", "{file}"]
+        },
+        "go": {
+            "file_ext": ".go",
+            "run_cmd": ["go", "run", "{file}"],
+            "build_cmd": ["go", "build", "-o", "{output}", "{file}"],
+            "build_ext": "",
+            "cached_run_cmd": ["{output}"]
+        },
+        "ruby": {
+            "file_ext": ".rb",
+            "run_cmd": ["ruby", "{file}"],
+            "stdin_cmd": ["ruby", "-"],
+            "warm": True
+        },
+        "php": {
+            "file_ext": ".php",
+            "run_cmd": ["php", "{file}"],
+            "stdin_cmd": ["php"]
         }
+    }
+    
+    def __init__(
+        self,
+        context: Optional[Dict[str, Any]] = None,
+        tracker_context: Any = None,
+        schema_gen: Any = None,
+    ):
+        """
+        Args:
+            context: 代码求解时可用的上下文（all_context、URLs、all_knowledge等）
+            tracker_context: 跟踪器上下文
+            schema_gen: JSON模式生成器
+        """
+        self.context: Dict[str, Any] = context or {}
+        self.tracker_context = tracker_context
+        self.schema_gen = schema_gen
+        # 已完成启动、阻塞在读取标准输入上的备用进程（每个进程只执行一次代码）
+        self._warm_workers: Dict[str, List[asyncio.subprocess.Process]] = {}
+    
+    @staticmethod
+    async def _spawn_process(cmd: List[str], with_stdin: bool) -> asyncio.subprocess.Process:
+        """
+        启动执行代码的子进程
+        
+        Args:
+            cmd: 执行命令
+            with_stdin: 是否为子进程打开标准输入管道
+            
+        Returns:
+            子进程对象
+        """
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if with_stdin else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=1024 * 1024,  # 1MB限制
+            start_new_session=True  # 独立进程组，超时时可连同子进程一起终止
+        )
+    
+    async def _acquire_warm_process(self, language: str, cmd: List[str]) -> asyncio.subprocess.Process:
+        """
+        取出一个备用解释器进程，并补充新的备用进程
+        
+        Args:
+            language: 编程语言
+            cmd: 从标准输入读取代码的执行命令
+            
+        Returns:
+            等待写入代码的子进程
+        """
+        pool = self._warm_workers.setdefault(language, [])
+        process = None
+        while pool:
+            candidate = pool.pop()
+            if candidate.returncode is None:
+                process = candidate
+                break
+                
+        if process is None:
+            process = await self._spawn_process(cmd, True)
+            
+        # 补充备用进程，解释器启动与本次执行并行进行
+        while len(pool) < WARM_POOL_SIZE:
+            pool.append(await self._spawn_process(cmd, True))
+            
+        return process
+    
+    async def close(self) -> None:
+        """
+        终止所有未使用的备用进程
+        """
+        workers = [process for pool in self._warm_workers.values() for process in pool]
+        self._warm_workers.clear()
+        for process in workers:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError, AttributeError):
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+        for process in workers:
+            try:
+                await process.wait()
+            except Exception:
+                pass
+    
+    def update_context(self, context: Dict[str, Any]) -> None:
+        """
+        替换沙箱上下文，使同一沙箱实例可以在一次运行的多个步骤间复用
+        
+        Args:
+            context: 新的上下文字典
+        """
+        self.context = context
     
     async def generate_code(self, problem_description: str, language: str = "python") -> CodeGenResponse:
         """
@@ -76,9 +331,7 @@ class CodeSandbox:
             )
             
         try:
-            from openai import OpenAI
-            
-            client = OpenAI(api_key=OPENAI_API_KEY)
+            client = get_openai_client()
             
             # 构建系统提示
             system_prompt = f"""你是一位专业的{language}编程专家。你需要为用户生成解决特定问题的代码。
@@ -106,12 +359,11 @@ class CodeSandbox:
             
             content = response.choices[0].message.content
             
-            # 尝试从内容中提取代码块
-            code_blocks = re.findall(r'```(?:\w*\n)?([\s\S]*?)```', content)
+            # 尝试从内容中提取第一个代码块作为实现，找到即停止
+            code_block = _CODE_BLOCK_RE.search(content)
             
-            if code_blocks:
-                # 提取第一个代码块作为实现
-                code = code_blocks[0].strip()
+            if code_block:
+                code = code_block.group(1).strip()
             else:
                 # 如果没有代码块标记，尝试提取整个内容
                 code = content.strip()
@@ -129,6 +381,106 @@ class CodeSandbox:
                 code=""
             )
     
+    async def _get_cached_build(
+        self, code: str, config: Dict[str, Any], timeout: int
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        获取代码的编译产物，未命中缓存时编译并写入缓存
+        
+        Args:
+            code: 源代码
+            config: 语言配置
+            timeout: 编译超时时间（秒）
+            
+        Returns:
+            (编译产物路径, 编译失败时的执行结果字典)
+        """
+        digest = hashlib.blake2b(code.encode("utf-8"), digest_size=16).hexdigest()
+        cache_dir = os.path.join(BUILD_CACHE_DIR, config["file_ext"].lstrip("."))
+        output_path = os.path.join(cache_dir, f"{digest}{config['build_ext']}")
+        
+        if os.path.exists(output_path):
+            # 更新访问时间，供LRU淘汰使用
+            try:
+                os.utime(output_path, None)
+            except OSError:
+                pass
+            return output_path, None
+            
+        os.makedirs(cache_dir, exist_ok=True)
+        # 先编译到临时文件名再原子替换，避免并发请求读到未写完的产物
+        partial_path = os.path.join(cache_dir, f"{digest}.{uuid.uuid4()}.tmp{config['build_ext']}")
+        source_path = None
+        
+        try:
+            source_path = _write_tmp_source(code, config["file_ext"])
+            cmd = [cmd_part.format(file=source_path, output=partial_path) for cmd_part in config["build_cmd"]]
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                return None, {
+                    "success": False,
+                    "stdout": "",
+                    "stderr": f"编译超时（{timeout}秒）",
+                    "error": "编译超时"
+                }
+                
+            if process.returncode != 0:
+                return None, {
+                    "success": False,
+                    "stdout": stdout.decode('utf-8', errors='replace'),
+                    "stderr": stderr.decode('utf-8', errors='replace'),
+                    "exit_code": process.returncode
+                }
+                
+            os.replace(partial_path, output_path)
+            self._evict_build_cache(cache_dir)
+            return output_path, None
+            
+        finally:
+            _remove_quietly(source_path)
+            _remove_quietly(partial_path)
+    
+    @staticmethod
+    def _evict_build_cache(cache_dir: str) -> None:
+        """
+        缓存目录超过容量上限时，按最近访问时间淘汰最旧的编译产物
+        
+        Args:
+            cache_dir: 缓存目录
+        """
+        try:
+            stats = []
+            for entry in os.scandir(cache_dir):
+                if entry.is_file():
+                    st = entry.stat()
+                    stats.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            return
+            
+        total_size = sum(size for _, size, _ in stats)
+        if total_size <= MAX_BUILD_CACHE_BYTES:
+            return
+            
+        for _, size, path in sorted(stats):
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                continue
+            if total_size <= MAX_BUILD_CACHE_BYTES:
+                break
+    
     async def execute_code(self, code: str, language: str = "python", timeout: int = 30) -> Dict[str, Any]:
         """
         执行代码
@@ -149,38 +501,42 @@ class CodeSandbox:
                 "error": f"不支持的编程语言: {language}"
             }
             
-        # 创建临时文件
+        file_path = None
         try:
             config = self.language_configs[language]
-            file_ext = config["file_ext"]
-            run_cmd = config["run_cmd"]
+            stdin_cmd = config.get("stdin_cmd")
             
-            # 创建唯一的临时文件
-            unique_id = str(uuid.uuid4())
-            temp_dir = tempfile.gettempdir()
-            file_path = os.path.join(temp_dir, f"sandbox_{unique_id}{file_ext}")
+            build_cmd = config.get("build_cmd")
             
-            # 写入代码到临时文件
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(code)
-                
-            # 准备执行命令
-            cmd = [cmd_part.format(file=file_path) for cmd_part in run_cmd]
+            if stdin_cmd:
+                # 通过管道把代码传给解释器
+                cmd = list(stdin_cmd)
+                stdin_data = code.encode("utf-8")
+            elif build_cmd and shutil.which(build_cmd[0]):
+                # 命中缓存直接执行编译产物，否则先编译一次
+                output_path, build_error = await self._get_cached_build(code, config, timeout)
+                if build_error:
+                    return build_error
+                cmd = [cmd_part.format(output=output_path) for cmd_part in config["cached_run_cmd"]]
+                stdin_data = None
+            else:
+                # 需要源文件的语言（go run、ts-node）仍写入唯一的临时文件
+                file_path = _write_tmp_source(code, config["file_ext"])
+                cmd = [cmd_part.format(file=file_path) for cmd_part in config["run_cmd"]]
+                stdin_data = None
             
             # 设置超时
             try:
                 # 执行代码
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    limit=1024 * 1024  # 1MB限制
-                )
+                if stdin_data is not None and config.get("warm"):
+                    process = await self._acquire_warm_process(language, cmd)
+                else:
+                    process = await self._spawn_process(cmd, stdin_data is not None)
                 
                 try:
-                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-                    stdout_str = stdout.decode('utf-8', errors='replace')
-                    stderr_str = stderr.decode('utf-8', errors='replace')
+                    stdout_str, stderr_str = await asyncio.wait_for(
+                        _communicate_bounded(process, stdin_data), timeout=timeout
+                    )
                     
                     return {
                         "success": process.returncode == 0,
@@ -190,10 +546,19 @@ class CodeSandbox:
                     }
                     
                 except asyncio.TimeoutError:
-                    # 超时，终止进程
+                    # 超时，终止整个进程组（包括用户代码派生的子进程）
                     try:
-                        process.kill()
-                    except:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except (ProcessLookupError, PermissionError, AttributeError):
+                        # 进程已退出，或平台不支持进程组时只终止主进程
+                        try:
+                            process.kill()
+                        except ProcessLookupError:
+                            pass
+                    # 回收子进程并关闭管道，避免僵尸进程和文件描述符泄漏
+                    try:
+                        await process.wait()
+                    except Exception:
                         pass
                         
                     return {
@@ -221,12 +586,8 @@ class CodeSandbox:
             
         finally:
             # 清理临时文件
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except:
-                pass
-                
+            _remove_quietly(file_path)
+
 
 if __name__ == "__main__":
     # 测试代码
@@ -9,16 +9,23 @@ try:
     from ..model_types import ErrorAnalysisResponse, PromptPair, TrackerContext
     from ..utils.safe_generator import ObjectGeneratorSafe
     from ..utils.schemas import JsonSchemaGen
+    from ..utils.text_tools import PrecompiledTemplate
+    from ..config import DEBUG
     from ..prompt_template import ERROR_ANALYZER_SYSTEM_PROMPT_TEMPLATE, ERROR_ANALYZER_USER_PROMPT_TEMPLATE
 except ImportError:
     from deepresearch.model_types import ErrorAnalysisResponse, PromptPair, TrackerContext
     from deepresearch.utils.safe_generator import ObjectGeneratorSafe
     from deepresearch.utils.schemas import JsonSchemaGen
+    from deepresearch.utils.text_tools import PrecompiledTemplate
+    from deepresearch.config import DEBUG
     from deepresearch.prompt_template import ERROR_ANALYZER_SYSTEM_PROMPT_TEMPLATE, ERROR_ANALYZER_USER_PROMPT_TEMPLATE
 
 
 TOOL_NAME = 'errorAnalyzer'
 
+# 提示模板导入时预先解析
+ERROR_ANALYZER_USER_PROMPT_TEMPLATE = PrecompiledTemplate(ERROR_ANALYZER_USER_PROMPT_TEMPLATE)
+
 
 def get_prompt(diary_context: List[str]) -> PromptPair:
     """
@@ -33,9 +40,9 @@ def get_prompt(diary_context: List[str]) -> PromptPair:
     # 格式化系统提示
     system_prompt = ERROR_ANALYZER_SYSTEM_PROMPT_TEMPLATE
     
-    # 格式化用户提示
+    # 格式化用户提示：日志条目拼接成一个文本块，而不是列表的repr（后者会把换行转义成\n并给每条加引号）
     user_prompt = ERROR_ANALYZER_USER_PROMPT_TEMPLATE.format(
-        diary_context=diary_context
+        diary_context="\n".join(diary_context)
     )
     
     return PromptPair(
@@ -61,9 +68,10 @@ async def analyze_steps(
             "prompt": prompt.user
         })
 
-        print(f"【error_analyzer】: {prompt.system}")
-        print(f"【error_analyzer】: {prompt.user}")
-        print(f"【error_analyzer】: {result.object}")
+        if DEBUG:
+            print(f"【error_analyzer】: {prompt.system}")
+            print(f"【error_analyzer】: {prompt.user}")
+            print(f"【error_analyzer】: {result.object}")
         trackers.action_tracker.track_think(result.object["blame"])
         trackers.action_tracker.track_think(result.object["improvement"])
 
@@ -1,6 +1,7 @@
 """
 答案评估工具 - 评估搜索结果和最终答案的质量
 """
+import asyncio
 import json
 import re
 import datetime
@@ -9,6 +10,8 @@ from pathlib import Path
 from json_repair import repair_json
 from typing import Dict, List, Any, Optional, Union, Tuple
 
+import orjson
+
 # 确保项目根目录在Python路径中
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
@@ -18,9 +21,9 @@ try:
         Reference, AnswerAction, PromptPair, TrackerContext,
         TokenTracker, ActionTracker
     )
-    from ..utils.text_tools import get_knowledge_str
-    from ..utils.safe_generator import ObjectGeneratorSafe
+    from ..utils.text_tools import get_knowledge_str, PrecompiledTemplate
     from ..utils.schemas import JsonSchemaGen
+    from ..config import DEBUG
     from ..prompt_template import REJECT_ALL_ANSWERS_SYSTEM_PROMPT, REJECT_ALL_ANSWERS_USER_PROMPT, DEFINITIVE_SYSTEM_PROMPT, DEFINITIVE_USER_PROMPT, FRESHNESS_SYSTEM_PROMPT, FRESHNESS_USER_PROMPT, COMPLETENESS_SYSTEM_PROMPT, COMPLETENESS_USER_PROMPT, PLURALITY_SYSTEM_PROMPT, PLURALITY_USER_PROMPT, QUESTION_EVALUATION_SYSTEM_PROMPT, QUESTION_EVALUATION_USER_PROMPT
 except ImportError:
     from deepresearch.model_types import (
@@ -28,66 +31,75 @@ except ImportError:
         Reference, AnswerAction, PromptPair, TrackerContext,
         TokenTracker, ActionTracker
     )
-    from deepresearch.utils.text_tools import get_knowledge_str
-    from deepresearch.utils.safe_generator import ObjectGeneratorSafe
+    from deepresearch.utils.text_tools import get_knowledge_str, PrecompiledTemplate
     from deepresearch.utils.schemas import JsonSchemaGen
+    from deepresearch.config import DEBUG
     from deepresearch.prompt_template import REJECT_ALL_ANSWERS_SYSTEM_PROMPT, REJECT_ALL_ANSWERS_USER_PROMPT, DEFINITIVE_SYSTEM_PROMPT, DEFINITIVE_USER_PROMPT, FRESHNESS_SYSTEM_PROMPT, FRESHNESS_USER_PROMPT, COMPLETENESS_SYSTEM_PROMPT, COMPLETENESS_USER_PROMPT, PLURALITY_SYSTEM_PROMPT, PLURALITY_USER_PROMPT, QUESTION_EVALUATION_SYSTEM_PROMPT, QUESTION_EVALUATION_USER_PROMPT
 TOOL_NAME = 'evaluator'
 
+# 每次评估都要格式化的提示模板，导入时预先解析；
+# 下面的提示构建函数只填入字符串，用PromptPair.model_construct跳过重复校验
+REJECT_ALL_ANSWERS_SYSTEM_PROMPT = PrecompiledTemplate(REJECT_ALL_ANSWERS_SYSTEM_PROMPT)
+REJECT_ALL_ANSWERS_USER_PROMPT = PrecompiledTemplate(REJECT_ALL_ANSWERS_USER_PROMPT)
+DEFINITIVE_USER_PROMPT = PrecompiledTemplate(DEFINITIVE_USER_PROMPT)
+FRESHNESS_SYSTEM_PROMPT = PrecompiledTemplate(FRESHNESS_SYSTEM_PROMPT)
+FRESHNESS_USER_PROMPT = PrecompiledTemplate(FRESHNESS_USER_PROMPT)
+COMPLETENESS_USER_PROMPT = PrecompiledTemplate(COMPLETENESS_USER_PROMPT)
+PLURALITY_USER_PROMPT = PrecompiledTemplate(PLURALITY_USER_PROMPT)
+QUESTION_EVALUATION_USER_PROMPT = PrecompiledTemplate(QUESTION_EVALUATION_USER_PROMPT)
+
 
-def get_reject_all_answers_prompt(question: str, answer: AnswerAction, all_knowledge: List[KnowledgeItem]) -> PromptPair:
+def get_reject_all_answers_prompt(
+    question: str,
+    answer: AnswerAction,
+    all_knowledge: List[KnowledgeItem],
+    knowledge_strings: Optional[List[str]] = None,
+) -> PromptPair:
     """生成拒绝所有答案的提示"""
-    knowledge_str = get_knowledge_str(all_knowledge)
+    # get_knowledge_str已用换行符连接各知识项，与TypeScript版本保持一致
+    knowledge_str = get_knowledge_str(all_knowledge, knowledge_strings)
     answer_text = answer.answer if isinstance(answer, AnswerAction) else answer
     
-    # 获取知识字符串列表，然后用换行符连接，与TypeScript版本保持一致
-    knowledge_str_list = knowledge_str
-    knowledge_str_joined = '\n\n'.join(knowledge_str_list)
-    
-    return PromptPair(
-        system=REJECT_ALL_ANSWERS_SYSTEM_PROMPT.format(knowledge_str=knowledge_str_joined),
+    return PromptPair.model_construct(
+        system=REJECT_ALL_ANSWERS_SYSTEM_PROMPT.format(knowledge_str=knowledge_str),
         user=REJECT_ALL_ANSWERS_USER_PROMPT.format(question=question, answer_text=answer_text)
     )
 
 def get_definitive_prompt(question: str, answer: str) -> PromptPair:
     """生成确定性评估提示"""
-    return PromptPair(
+    return PromptPair.model_construct(
         system=DEFINITIVE_SYSTEM_PROMPT,
         user=DEFINITIVE_USER_PROMPT.format(question=question, answer=answer)
     )
 
 def get_freshness_prompt(question: str, answer: AnswerAction, current_time: str) -> PromptPair:
     """生成时效性评估提示"""
-    def custom_json_serializer(obj):
-        if isinstance(obj, AnswerAction):
-            return obj.__dict__  # 返回类的 __dict__ 属性
-        if isinstance(obj, Reference):
-            return obj.__dict__  # 如果是 Reference 类型，也返回其 __dict__
-        raise TypeError(f"Type {type(obj)} not serializable")
-        
-    
-    return PromptPair(
+    # model_dump(mode="json")一次性转换为只含基本类型的字典（包括嵌套的Reference），序列化时无需default回调
+    answer_obj = answer.model_dump(mode="json") if isinstance(answer, AnswerAction) else answer
+    answer_json = orjson.dumps(answer_obj).decode()
+
+    return PromptPair.model_construct(
         system=FRESHNESS_SYSTEM_PROMPT.format(current_time=current_time),
-        user= FRESHNESS_USER_PROMPT.format(question=question, answer_json=json.dumps(answer.__dict__ if isinstance(answer, AnswerAction) else answer, default=custom_json_serializer, ensure_ascii=False))
+        user= FRESHNESS_USER_PROMPT.format(question=question, answer_json=answer_json)
     )
 
 def get_completeness_prompt(question: str, answer: str) -> PromptPair:
     """生成完整性评估提示"""
-    return PromptPair(
+    return PromptPair.model_construct(
         system=COMPLETENESS_SYSTEM_PROMPT,
         user=COMPLETENESS_USER_PROMPT.format(question=question, answer=answer)
     )
 
 def get_plurality_prompt(question: str, answer: str) -> PromptPair:
     """生成多样性评估提示"""
-    return PromptPair(
+    return PromptPair.model_construct(
         system=PLURALITY_SYSTEM_PROMPT,
         user=PLURALITY_USER_PROMPT.format(question=question, answer=answer)
     )
 
 def get_question_evaluation_prompt(question: str) -> PromptPair:
     """生成问题评估提示"""
-    return PromptPair(
+    return PromptPair.model_construct(
         system=QUESTION_EVALUATION_SYSTEM_PROMPT,
         user=QUESTION_EVALUATION_USER_PROMPT.format(question=question)
     )
@@ -115,7 +127,7 @@ async def evaluate_question(
     try:
         prompt = get_question_evaluation_prompt(question)
         
-        generator = ObjectGeneratorSafe(trackers.token_tracker)
+        generator = trackers.generator
 
         result = await generator.generate_object({
             "model": TOOL_NAME,
@@ -152,7 +164,7 @@ async def perform_evaluation(
     schema_gen: Any
 ) -> Dict[str, Any]:
     """执行特定类型的评估"""
-    generator = ObjectGeneratorSafe(trackers.token_tracker)
+    generator = trackers.generator
     result = await generator.generate_object({
         "model": TOOL_NAME,
         "schema": schema_gen.get_evaluator_schema(evaluation_type),
@@ -167,17 +179,35 @@ async def perform_evaluation(
 
     return result
 
+# 提前返回后仍在后台运行的评估任务，持有引用避免被垃圾回收
+_background_evaluations: set = set()
+
+def _finish_background_evaluation(task: asyncio.Task) -> None:
+    """后台评估完成后释放引用，并取出异常避免"Task exception was never retrieved"警告"""
+    _background_evaluations.discard(task)
+    error = None if task.cancelled() else task.exception()
+    if error is not None and DEBUG:
+        print(f"后台评估出错: {error}")
+
 async def evaluate_answer(
     question: str,
     action: AnswerAction,
     evaluation_types: List[EvaluationType],
     trackers: TrackerContext,
     all_knowledge: List[KnowledgeItem],
-    schema_gen: Any
+    schema_gen: Any,
+    knowledge_strings: Optional[List[str]] = None,
 ) -> EvaluationResponse:
-    """评估答案"""
-    result = None
-    
+    """评估答案
+
+    knowledge_strings为调用方持有的已格式化知识项缓存，用于增量构建严格评估的知识字符串。
+    除STRICT外的各项评估互不依赖，并发请求，按evaluation_types的顺序检查结果，
+    遇到第一个未通过的评估即返回，其余评估在后台完成（同步客户端的请求无法中止，仍需计入令牌用量）；
+    STRICT的提示包含全部知识、代价最高，只在其余评估都通过后再执行
+    """
+    independent: List[Tuple[EvaluationType, PromptPair]] = []
+    deferred: List[EvaluationType] = []
+
     for evaluation_type in evaluation_types:
         
         if evaluation_type == EvaluationType.DEFINITIVE:
@@ -189,30 +219,60 @@ async def evaluate_answer(
         elif evaluation_type == EvaluationType.COMPLETENESS:
             prompt = get_completeness_prompt(question, action.answer)
         elif evaluation_type == EvaluationType.STRICT:
-            prompt = get_reject_all_answers_prompt(question, action, all_knowledge)
+            deferred.append(evaluation_type)
+            continue
         else:
             print(f"Unknown evaluation type: {evaluation_type}")
             continue
             
         if prompt:
-            result = await perform_evaluation(
-                evaluation_type,
-                prompt,
-                trackers,
-                schema_gen
-            )
-            
-            # 如果一个评估失败，立即返回
-            result = result.object
+            independent.append((evaluation_type, prompt))
+
+    result = None
+
+    async def run_evaluation(evaluation_type: EvaluationType, prompt: PromptPair):
+        return evaluation_type, await perform_evaluation(evaluation_type, prompt, trackers, schema_gen)
+
+    tasks = [
+        asyncio.create_task(run_evaluation(evaluation_type, prompt))
+        for evaluation_type, prompt in independent
+    ]
+    checked = 0
+    try:
+        for task in tasks:
+            # 按顺序检查，返回的失败项不取决于哪个请求先完成
+            evaluation_type, evaluation = await task
+            checked += 1
+            result = evaluation.object
             if not result.get("pass_eval", False):
                 result["type"] = evaluation_type
                 return EvaluationResponse.model_construct(**result)
+    finally:
+        # 提前返回时不取消其余评估：线程中的LLM请求取消后仍会完成并计费，
+        # 取消只会跳过令牌统计；让它们在后台完成并记录用量
+        for task in tasks[checked:]:
+            _background_evaluations.add(task)
+            task.add_done_callback(_finish_background_evaluation)
+
+    if tasks:
+        # 全部通过时与顺序执行一致，取最后一项评估的结果
+        result = tasks[-1].result()[1].object
+
+    for evaluation_type in deferred:
+        # 严格评估的提示只在需要时才构建
+        prompt = get_reject_all_answers_prompt(
+            question, action, all_knowledge, knowledge_strings
+        )
+        result = (
+            await perform_evaluation(evaluation_type, prompt, trackers, schema_gen)
+        ).object
+        if not result.get("pass_eval", False):
+            result["type"] = evaluation_type
+            return EvaluationResponse.model_construct(**result)
                 
-    return EvaluationResponse.model_construct(**result.object)
+    return EvaluationResponse.model_construct(**(result or {}))
 
 if __name__ == "__main__":
-    import asyncio
-
     # async def test_evaluate_question():
     #     # 创建必要的上下文对象
     #     token_tracker = TokenTracker()
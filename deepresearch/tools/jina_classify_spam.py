@@ -1,4 +1,4 @@
-import requests
+import aiohttp
 from typing import Optional
 import sys
 import asyncio
@@ -12,11 +12,13 @@ try:
     from ..utils.token_tracker import TokenTracker
     from ..utils.action_tracker import ActionTracker
     from ..config import JINA_API_KEY
+    from ..utils.http_client import post_json_with_retry
 except ImportError:
     from deepresearch.model_types import TrackerContext
     from deepresearch.utils.token_tracker import TokenTracker
     from deepresearch.utils.action_tracker import ActionTracker
     from deepresearch.config import JINA_API_KEY
+    from deepresearch.utils.http_client import post_json_with_retry
 
 JINA_API_URL = "https://api.jina.ai/v1/classify"
 
@@ -53,12 +55,7 @@ async def classify_text(
     timeout_seconds = timeout_ms / 1000
 
     try:
-        response = requests.post(
-            JINA_API_URL, json=request, headers=headers, timeout=timeout_seconds
-        )
-
-        response.raise_for_status()
-        data = response.json()
+        data = await post_json_with_retry(JINA_API_URL, request, headers, timeout_seconds)
 
         if tracker_context and "usage" in data:
             tracker_context.token_tracker.track_usage(
@@ -73,9 +70,9 @@ async def classify_text(
         if data.get("data") and data["data"]:
             return data["data"][0]["prediction"] == "true"
 
-    except requests.exceptions.Timeout:
+    except asyncio.TimeoutError:
         print(f"分类请求超时: {timeout_ms}ms后超时")
-    except requests.exceptions.RequestException as error:
+    except aiohttp.ClientError as error:
         print("文本分类出错:", error)
 
     return False
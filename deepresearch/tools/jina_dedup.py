@@ -1,3 +1,4 @@
+import re
 import requests
 import numpy as np
 from typing import Dict, List, Any, Optional
@@ -12,15 +13,35 @@ try:
     from ..model_types import TrackerContext
     from ..utils.token_tracker import TokenTracker
     from ..utils.action_tracker import ActionTracker
-    from ..tools.jina_embedding import get_embeddings, cosine_similarity
+    from ..tools.jina_embedding import get_embeddings
 except ImportError:
     from deepresearch.model_types import TrackerContext
     from deepresearch.utils.token_tracker import TokenTracker
     from deepresearch.utils.action_tracker import ActionTracker
-    from deepresearch.tools.jina_embedding import get_embeddings, cosine_similarity
+    from deepresearch.tools.jina_embedding import get_embeddings
 
 
-SIMILARITY_THRESHOLD = 0.86  # 可调整的余弦相似度阈值
+SIMILARITY_THRESHOLD = 0.86  # 可调整的余弦相似度阈值（float嵌入）
+# 可调整的汉明相似度阈值（ubinary嵌入）：符号量化后的比特一致率约为1 - arccos(余弦)/π，0.83对应余弦0.86
+BINARY_SIMILARITY_THRESHOLD = 0.83
+# 去重只需比较相似度排序，默认请求按位打包的ubinary嵌入，响应体约为float的1/32；设为"float"使用余弦相似度
+DEDUP_EMBEDDING_TYPE = "ubinary"
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _pairwise_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a与b各行之间的相似度矩阵：ubinary嵌入为汉明相似度，float嵌入（已归一化）为余弦相似度"""
+    if a.dtype == np.uint8:
+        differing_bits = np.bitwise_count(a[:, None, :] ^ b[None, :, :]).sum(axis=-1)
+        return 1.0 - differing_bits / (a.shape[1] * 8)
+    return a @ b.T
+
+
+def _canonical_query(query: str) -> str:
+    """查询的规范形式：小写、去除标点、合并空白，用于本地精确去重"""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
 
 
 async def dedup_queries(
@@ -41,57 +62,78 @@ async def dedup_queries(
     Returns:
         去重后的唯一查询列表
     """
-    # 快速路径：如果只有一个新查询且没有现有查询
+    # 先在本地去掉规范形式相同的查询（包括与现有查询相同的），无需请求嵌入
+    existing_keys = {_canonical_query(q) for q in existing_queries}
+    seen_keys = set()
+    candidate_queries = []
+    for q in new_queries:
+        key = _canonical_query(q)
+        if key in existing_keys or key in seen_keys:
+            continue
+        seen_keys.add(key)
+        candidate_queries.append(q)
+    new_queries = candidate_queries
+
+    if not new_queries:
+        return {"unique_queries": []}
+
+    # 快速路径：如果只剩一个新查询且没有现有查询
     if len(new_queries) == 1 and not existing_queries:
         print(f"【dedup_queries】 \n New queries: {new_queries} \n Existing queries: {existing_queries} \n -> Unique queries: {new_queries}")
-        return {"unique_queries": unique_queries}
+        return {"unique_queries": new_queries}
 
     try:
-        # 批量获取所有查询的嵌入向量
-        all_queries = new_queries + existing_queries
-        result = await get_embeddings(all_queries)
-        all_embeddings = result.get("embeddings", [])
-        tokens = result.get("tokens", 0)
-
-        # 如果嵌入为空，返回所有新查询
-        if not all_embeddings:
-            return new_queries
-
-        # 将嵌入分回新的和现有的
-        new_embeddings = all_embeddings[: len(new_queries)]
-        existing_embeddings = all_embeddings[len(new_queries) :]
-
+        # 新查询与现有查询分别获取嵌入，不再拼接两个列表；两次并发请求会被嵌入微批处理器合并为一次Jina请求，
+        # 已缓存的查询由get_embeddings直接返回缓存的嵌入
+        binary = DEDUP_EMBEDDING_TYPE == "ubinary"
+        query_groups = [new_queries]
+        if existing_queries:
+            query_groups.append(list(dict.fromkeys(existing_queries)))
+        results = await asyncio.gather(
+            *(get_embeddings(group, embedding_type=DEDUP_EMBEDDING_TYPE) for group in query_groups)
+        )
+        tokens = 0
+        matrices = []
+        for result in results:
+            embeddings = result.get("embeddings", [])
+
+            # 如果嵌入为空，返回所有新查询
+            if len(embeddings) == 0:
+                return {"unique_queries": new_queries}
+
+            # float嵌入归一化后点积即余弦相似度
+            matrix = np.asarray(embeddings, dtype=np.uint8 if binary else np.float32)
+            if not binary:
+                matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+            matrices.append(matrix)
+            tokens += result.get("tokens", 0)
+
+        # 一次计算新查询与全部现有查询的相似度矩阵
+        threshold = BINARY_SIMILARITY_THRESHOLD if binary else SIMILARITY_THRESHOLD
+        new_embeddings = matrices[0]
+        existing_embeddings = matrices[1] if len(matrices) > 1 else None
+
+        if existing_embeddings is not None:
+            is_candidate = _pairwise_similarity(new_embeddings, existing_embeddings).max(axis=1) < threshold
+        else:
+            is_candidate = np.ones(len(new_queries), dtype=bool)
+
+        # 依次将候选查询与已接受的查询比较；已接受的嵌入连续存放在预分配的缓冲区前kept_count行，
+        # 每个候选只需与其做一次矩阵-向量运算
         unique_queries = []
-        used_indices = set()
-
-        # 将每个新查询与现有查询和已接受的查询进行比较
-        for i in range(len(new_queries)):
-            is_unique = True
-
-            # 与现有查询比较
-            for j in range(len(existing_queries)):
-                if (
-                    cosine_similarity(new_embeddings[i], existing_embeddings[j]) >= SIMILARITY_THRESHOLD
-                ):
-                    is_unique = False
-                    break
-
-            # 与已接受的查询比较
-            if is_unique:
-                for used_index in used_indices:
-                    if (
-                        cosine_similarity(new_embeddings[i], new_embeddings[used_index]) >= SIMILARITY_THRESHOLD
-                    ):
-                        is_unique = False
-                        break
-
-            # 如果通过所有检查，则添加到唯一查询中
-            if is_unique:
-                unique_queries.append(new_queries[i])
-                used_indices.add(i)
+        kept = np.empty_like(new_embeddings)
+        kept_count = 0
+        for i in np.flatnonzero(is_candidate):
+            if kept_count and _pairwise_similarity(
+                kept[:kept_count], new_embeddings[i : i + 1]
+            ).max() >= threshold:
+                continue
+            unique_queries.append(new_queries[i])
+            kept[kept_count] = new_embeddings[i]
+            kept_count += 1
 
         # 跟踪API的令牌使用情况
-        if tracker_context:
+        if tracker_context and tokens:
             tracker_context.token_tracker.track_usage(
                 "dedup",
                 {
@@ -106,7 +148,7 @@ async def dedup_queries(
 
     except Exception as error:
         print("去重分析中出错:", error)
-        return new_queries
+        return {"unique_queries": new_queries}
 
 
 if __name__ == "__main__":
@@ -1,7 +1,12 @@
-import requests
+import asyncio
+import base64
+import hashlib
+import math
+import aiohttp
 import numpy as np
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import sys
+from collections import OrderedDict
 from pathlib import Path
 
 # 确保项目根目录在Python路径中
@@ -9,48 +14,113 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 try:
     from ..config import JINA_API_KEY, JINA_API_URL
+    from ..utils.http_client import post_json_with_retry
 except ImportError:
     from deepresearch.config import JINA_API_KEY, JINA_API_URL
+    from deepresearch.utils.http_client import post_json_with_retry
 
 
-def cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
-    """计算两个向量之间的余弦相似度"""
-    a = np.array(vec_a)
-    b = np.array(vec_b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+# 微批处理：同一配置的请求在该时间窗口（秒）内合并为一次Jina请求，或凑满该条数后立即发出
+EMBEDDING_BATCH_WINDOW = 0.01
+MAX_EMBEDDING_BATCH_SIZE = 512
 
+# 各嵌入类型解码后的元素类型：ubinary为按位打包的uint8（1024维只需128字节），base64为float32的原始字节
+_EMBEDDING_DTYPES = {"float": np.float32, "base64": np.float32, "ubinary": np.uint8}
 
-async def get_embeddings(
-    input: List[str],
-    model: str = "jina-embeddings-v3",
-    task: str = "text-matching",
-    dimensions: int = 1024,
-    embedding_type: str = "float",
-    late_chunking: bool = False,
-    timeout_ms: int = 30000,
-    truncate: bool = True,
-) -> Dict[str, Any]:
+# 嵌入向量的进程内LRU缓存，键为请求配置加文本哈希；一次会话中反复去重的查询不再重复请求和计费
+MAX_EMBEDDING_CACHE_SIZE = 10000
+_embedding_cache: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+
+
+def cosine_similarity(vec_a: Any, vec_b: Any) -> float:
+    """计算两个向量之间的余弦相似度
+
+    接受列表或np.ndarray；传入float32数组时不会复制数据。范数由点积求得，省去两次np.linalg.norm调用
     """
-    获取文本的嵌入向量
+    a = np.asarray(vec_a, dtype=np.float32)
+    b = np.asarray(vec_b, dtype=np.float32)
+    return float(a @ b) / math.sqrt(float(a @ a) * float(b @ b) + 1e-30)
 
-    Args:
-        input: 要获取嵌入的文本列表
-        model: 嵌入模型名称
-        task: 嵌入任务类型
-        dimensions: 嵌入维度
-        embedding_type: 嵌入类型
-        late_chunking: 是否启用延迟分块
-        timeout_ms: 请求超时时间（毫秒）
-        truncate: 是否截断
-    Returns:
-        包含嵌入向量和令牌使用情况的字典
+
+class _EmbeddingBatcher:
+    """
+    把短时间内到达的、配置相同的嵌入请求合并为一次Jina请求，再把结果按各自的输入切片分发回去
     """
-    if not JINA_API_KEY:
-        print("JINA_API_KEY未设置")
-        return {"embeddings": [], "tokens": 0}
 
-    input = ["N/A" if not item.strip() else item for item in input]
+    def __init__(self, config: Tuple, loop: asyncio.AbstractEventLoop):
+        self.config = config
+        self.loop = loop
+        self.pending: List[Tuple[List[str], asyncio.Future]] = []
+        self.pending_size = 0
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        # 持有进行中请求任务的引用，避免被垃圾回收
+        self.tasks: set = set()
+
+    async def submit(self, input: List[str]) -> Dict[str, Any]:
+        future = self.loop.create_future()
+        self.pending.append((input, future))
+        self.pending_size += len(input)
 
+        if self.pending_size >= MAX_EMBEDDING_BATCH_SIZE:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(EMBEDDING_BATCH_WINDOW, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending, self.pending_size = self.pending, [], 0
+        if batch:
+            task = self.loop.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: List[Tuple[List[str], asyncio.Future]]) -> None:
+        merged_input = [text for input, _ in batch for text in input]
+        try:
+            result = await _request_embeddings(merged_input, *self.config)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        embeddings = result["embeddings"]
+        tokens = result["tokens"]
+        offset = 0
+        for input, future in batch:
+            if future.done():
+                offset += len(input)
+                continue
+            if len(embeddings) == 0:
+                future.set_result({"embeddings": [], "tokens": 0})
+                continue
+            # 整批只计费一次，按输入条数分摊给各个调用方
+            future.set_result({
+                "embeddings": embeddings[offset : offset + len(input)],
+                "tokens": round(tokens * len(input) / len(merged_input)),
+            })
+            offset += len(input)
+
+
+# 按(请求配置)缓存的微批处理器；批处理器绑定创建它的事件循环
+_batchers: Dict[Tuple, _EmbeddingBatcher] = {}
+
+
+async def _request_embeddings(
+    input: List[str],
+    model: str,
+    task: str,
+    dimensions: int,
+    embedding_type: str,
+    late_chunking: bool,
+    timeout_ms: int,
+    truncate: bool,
+) -> Dict[str, Any]:
+    """向Jina发送一次嵌入请求"""
     request = {
         "model": model,
         "task": task,
@@ -69,32 +139,118 @@ async def get_embeddings(
     timeout_seconds = timeout_ms / 1000
 
     try:
-        response = requests.post(
-            JINA_API_URL,
-            json=request,
-            headers=headers,
-            timeout=timeout_seconds
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = await post_json_with_retry(JINA_API_URL, request, headers, timeout_seconds)
 
         if not data.get("data") or len(data["data"]) != len(input):
             print("来自Jina API的无效响应:", data)
             return {"embeddings": [], "tokens": 0}
 
-        embeddings = sorted(data["data"], key=lambda x: x["index"])
-        embeddings = [item["embedding"] for item in embeddings]
+        # 按index直接写入预分配的矩阵，不再排序和构造逐个数值的Python列表；
+        # 以字符串返回的嵌入是base64编码的原始字节
+        items = data["data"]
+        dtype = _EMBEDDING_DTYPES.get(embedding_type, np.float32)
+        rows = [
+            np.frombuffer(base64.b64decode(item["embedding"]), dtype=dtype)
+            if isinstance(item["embedding"], str) else item["embedding"]
+            for item in items
+        ]
+        embeddings = np.empty((len(items), len(rows[0])), dtype=dtype)
+        for item, row in zip(items, rows):
+            embeddings[item["index"]] = row
 
         return {
             "embeddings": embeddings,
             "tokens": data["usage"]["total_tokens"]
         }
 
-    except requests.exceptions.Timeout:
+    except asyncio.TimeoutError:
         print(f"嵌入请求超时: {timeout_ms}ms后超时")
         return {"embeddings": [], "tokens": 0}
-    except requests.exceptions.RequestException as error:
+    except aiohttp.ClientError as error:
         print("获取嵌入出错:", error)
-        if hasattr(error, "response") and error.response and error.response.status_code == 402:
+        if isinstance(error, aiohttp.ClientResponseError) and error.status == 402:
             return {"embeddings": [], "tokens": 0}
         raise error
+
+
+async def get_embeddings(
+    input: List[str],
+    model: str = "jina-embeddings-v3",
+    task: str = "text-matching",
+    dimensions: int = 1024,
+    embedding_type: str = "float",
+    late_chunking: bool = False,
+    timeout_ms: int = 30000,
+    truncate: bool = True,
+) -> Dict[str, Any]:
+    """
+    获取文本的嵌入向量
+
+    已缓存的文本直接返回缓存的嵌入，只对其余文本发起请求，返回的令牌数只包含这部分；
+    并发的同配置请求会被合并为一次Jina请求；late_chunking的嵌入依赖同一请求中的全部输入，不参与缓存和合并
+
+    Args:
+        input: 要获取嵌入的文本列表
+        model: 嵌入模型名称
+        task: 嵌入任务类型
+        dimensions: 嵌入维度
+        embedding_type: 嵌入类型
+        late_chunking: 是否启用延迟分块
+        timeout_ms: 请求超时时间（毫秒）
+        truncate: 是否截断
+    Returns:
+        包含嵌入向量和令牌使用情况的字典；嵌入为每行一个向量的np.ndarray（float/base64为float32，
+        ubinary为按位打包的uint8），请求失败时为空列表，调用方应以len()判断是否为空
+    """
+    if not JINA_API_KEY:
+        print("JINA_API_KEY未设置")
+        return {"embeddings": [], "tokens": 0}
+
+    input = ["N/A" if not item.strip() else item for item in input]
+
+    config = (model, task, dimensions, embedding_type, late_chunking, timeout_ms, truncate)
+    if late_chunking:
+        return await _request_embeddings(input, *config)
+
+    # 只为未缓存的文本请求嵌入
+    cache_config = (model, task, dimensions, embedding_type, truncate)
+    keys = [
+        cache_config + (hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(),)
+        for text in input
+    ]
+    missing = list(dict.fromkeys(
+        (key, text) for key, text in zip(keys, input) if key not in _embedding_cache
+    ))
+
+    tokens = 0
+    if missing:
+        missing_input = [text for _, text in missing]
+        if len(missing_input) >= MAX_EMBEDDING_BATCH_SIZE:
+            result = await _request_embeddings(missing_input, *config)
+        else:
+            loop = asyncio.get_running_loop()
+            batcher = _batchers.get(config)
+            if batcher is None or batcher.loop is not loop:
+                batcher = _batchers[config] = _EmbeddingBatcher(config, loop)
+            result = await batcher.submit(missing_input)
+
+        if len(result["embeddings"]) == 0:
+            return {"embeddings": [], "tokens": 0}
+
+        tokens = result["tokens"]
+        for (key, _), embedding in zip(missing, result["embeddings"]):
+            # 复制出独立的行：切片视图会让缓存条目引用整批结果矩阵，缓存条数上限就无法约束内存
+            _embedding_cache[key] = np.array(embedding)
+        while len(_embedding_cache) > MAX_EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+    rows = []
+    for key in keys:
+        # 本次需要的条目可能已被淘汰（单次输入超过缓存容量），此时重新请求全部输入
+        embedding = _embedding_cache.get(key)
+        if embedding is None:
+            return await _request_embeddings(input, *config)
+        _embedding_cache.move_to_end(key)
+        rows.append(embedding)
+
+    return {"embeddings": np.stack(rows), "tokens": tokens}
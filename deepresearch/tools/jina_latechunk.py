@@ -127,7 +127,7 @@ async def cherry_pick(
             batch_embeddings = batch_embedding_result["embeddings"]
 
             # 验证响应格式
-            if not batch_embeddings or len(batch_embeddings) != len(batch):
+            if len(batch_embeddings) != len(batch):
                 raise ValueError("来自API的意外响应格式")
 
             all_chunk_embeddings.extend(batch_embeddings)
@@ -149,10 +149,7 @@ async def cherry_pick(
         question_embedding = question_embedding_result["embeddings"][0]
 
         # 验证问题嵌入响应
-        if (
-            not question_embedding_result["embeddings"]
-            or len(question_embedding_result["embeddings"]) == 0
-        ):
+        if len(question_embedding_result["embeddings"]) == 0:
             raise ValueError("API响应中未找到问题嵌入")
 
         # 跟踪问题嵌入的令牌使用情况
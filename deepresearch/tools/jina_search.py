@@ -2,6 +2,7 @@
 Jina搜索工具 - 使用Jina API进行网络搜索
 """
 
+import asyncio
 import requests
 import json
 import sys
@@ -54,8 +55,10 @@ async def search(query: str, tracker_context: Optional[TrackerContext] = None) -
         # 设置超时
         timeout_seconds = 60.0
 
-        # 发送请求
-        response = requests.get(url, headers=headers, timeout=timeout_seconds)
+        # 在线程中发送请求，避免阻塞事件循环，使并发搜索真正并行
+        response = await asyncio.to_thread(
+            requests.get, url, headers=headers, timeout=timeout_seconds
+        )
         response.raise_for_status()  # 会自动处理HTTP错误
 
         # 解析响应JSON
@@ -142,8 +145,6 @@ async def search(query: str, tracker_context: Optional[TrackerContext] = None) -
 
 if __name__ == "__main__":
     # 测试代码
-    import asyncio
-
     async def test():
         # 为测试创建简单的令牌跟踪器
         tracker_context = TrackerContext(
@@ -6,23 +6,25 @@ from typing import List
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 try:
-    from openai import OpenAI
     from ..model_types import KnowledgeItem, PromptPair, TrackerContext, Reference
-    from ..utils.text_tools import get_knowledge_str
-    from ..config import OPENAI_API_KEY, OPENAI_BASE_URL, get_model
+    from ..utils.text_tools import get_knowledge_str, PrecompiledTemplate
+    from ..config import get_model, get_openai_client
     from ..utils.schemas import JsonSchemaGen
     from ..prompt_template_en import MD_FIXER_SYSTEM_PROMPT_TEMPLATE, MD_FIXER_USER_PROMPT_TEMPLATE
 except ImportError:
-    from openai import OpenAI
     from deepresearch.model_types import KnowledgeItem, PromptPair, TrackerContext, Reference
-    from deepresearch.utils.text_tools import get_knowledge_str
-    from deepresearch.config import OPENAI_API_KEY, OPENAI_BASE_URL, get_model
+    from deepresearch.utils.text_tools import get_knowledge_str, PrecompiledTemplate
+    from deepresearch.config import get_model, get_openai_client
     from deepresearch.utils.schemas import JsonSchemaGen
     from deepresearch.prompt_template_en import MD_FIXER_SYSTEM_PROMPT_TEMPLATE, MD_FIXER_USER_PROMPT_TEMPLATE
 
 # 工具名称
 TOOL_NAME = 'md-fixer'
 
+# 提示模板导入时预先解析
+MD_FIXER_SYSTEM_PROMPT_TEMPLATE = PrecompiledTemplate(MD_FIXER_SYSTEM_PROMPT_TEMPLATE)
+MD_FIXER_USER_PROMPT_TEMPLATE = PrecompiledTemplate(MD_FIXER_USER_PROMPT_TEMPLATE)
+
 
 def get_prompt(md_content: str, all_knowledge: List[KnowledgeItem]) -> PromptPair:
     """生成用于修复Markdown内容的提示"""
@@ -55,7 +57,7 @@ async def fix_markdown(
         prompt = get_prompt(md_content, knowledge_items)
         tracker_context.action_tracker.track_think('final_answer', schema.language_code)
         
-        client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        client = get_openai_client()
         result = client.chat.completions.create(
             model=get_model('evaluator')["model"],
             messages=[
@@ -1,3 +1,6 @@
+import asyncio
+import functools
+import time
 from datetime import datetime
 from typing import List
 import json
@@ -11,6 +14,7 @@ try:
     from ..config import get_model
     from ..model_types import PromptPair, SearchAction, SERPQuery, TrackerContext
     from ..utils.safe_generator import ObjectGeneratorSafe
+    from ..utils.text_tools import PrecompiledTemplate
     from ..utils.token_tracker import TokenTracker
     from ..utils.action_tracker import ActionTracker
     from ..utils.schemas import JsonSchemaGen
@@ -22,6 +26,7 @@ except ImportError:
     from deepresearch.config import get_model
     from deepresearch.model_types import PromptPair, SearchAction, SERPQuery, TrackerContext
     from deepresearch.utils.safe_generator import ObjectGeneratorSafe
+    from deepresearch.utils.text_tools import PrecompiledTemplate
     from deepresearch.utils.token_tracker import TokenTracker
     from deepresearch.utils.action_tracker import ActionTracker
     from deepresearch.utils.schemas import JsonSchemaGen
@@ -34,6 +39,21 @@ except ImportError:
 # 工具名称
 TOOL_NAME = "queryRewriter"
 
+# 每个搜索请求都要格式化的提示模板，导入时预先解析
+QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE = PrecompiledTemplate(QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE)
+QUERY_REWRITER_USER_PROMPT_TEMPLATE = PrecompiledTemplate(QUERY_REWRITER_USER_PROMPT_TEMPLATE)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_system_prompt(epoch_minute: int) -> str:
+    """按分钟格式化系统提示，分钟变化时自动失效"""
+    current_time = datetime.fromtimestamp(epoch_minute * 60)
+    return QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE.format(
+        current_time=current_time.isoformat(),
+        current_year=current_time.year,
+        current_month=current_time.month,
+    )
+
 
 def get_prompt(query: str, think: str, context: str) -> PromptPair:
     """
@@ -47,16 +67,8 @@ def get_prompt(query: str, think: str, context: str) -> PromptPair:
     Returns:
         提示对
     """
-    current_time = datetime.now()
-    current_year = current_time.year
-    current_month = current_time.month
-
-    # 格式化系统提示
-    system_prompt = QUERY_REWRITER_SYSTEM_PROMPT_TEMPLATE.format(
-        current_time=current_time.isoformat(),
-        current_year=current_year,
-        current_month=current_month,
-    )
+    # 系统提示按分钟缓存，同一分钟内（包括并发重写的各个请求）发送完全相同的系统提示
+    system_prompt = _build_system_prompt(int(time.time() // 60))
 
     # 格式化用户提示
     user_prompt = QUERY_REWRITER_USER_PROMPT_TEMPLATE.format(
@@ -86,20 +98,27 @@ async def rewrite_query(
     """
     try:
         generator = ObjectGeneratorSafe(tracker_context.token_tracker)
+        schema = schemas.get_query_rewriter_schema()
 
-        query_promises = []
-        for req in action.search_requests:
+        async def rewrite_one(req: str):
             prompt = get_prompt(req, action.think, context)
-            result = await generator.generate_object(
+            return await generator.generate_object(
                 {
                     "model": TOOL_NAME,
-                    "schema": schemas.get_query_rewriter_schema(),
+                    "schema": schema,
                     "system": prompt.system,
                     "prompt": prompt.user,
                     "num_retries": 0,
                 }
             )
 
+        # 各搜索请求的重写互不依赖，并发请求模型，按原顺序汇总结果
+        results = await asyncio.gather(
+            *(rewrite_one(req) for req in action.search_requests)
+        )
+
+        query_promises = []
+        for result in results:
             tracker_context.action_tracker.track_think(result.object.get("think", ""))
             query_promises.append(result.object.get("queries", []))
 
@@ -116,7 +135,6 @@ async def rewrite_query(
 
 
 if __name__ == "__main__":
-    import asyncio
     import json
     from deepresearch.model_types import SearchAction
     from deepresearch.utils.token_tracker import TokenTracker
@@ -0,0 +1,91 @@
+"""
+HTTP工具 - 共享的aiohttp会话和带重试的JSON请求
+"""
+import asyncio
+import random
+from typing import Any, Dict
+
+import aiohttp
+import orjson
+
+
+# 共享的aiohttp会话及其所属的事件循环；会话绑定创建它的事件循环，循环变化时重建
+_aiohttp_session = None
+_aiohttp_session_loop = None
+
+
+async def get_aiohttp_session():
+    """获取共享的aiohttp会话（首次调用时创建），Jina接口的请求复用同一个连接池
+
+    Returns:
+        aiohttp.ClientSession
+    """
+    global _aiohttp_session, _aiohttp_session_loop
+    loop = asyncio.get_running_loop()
+    if _aiohttp_session is None or _aiohttp_session.closed or _aiohttp_session_loop is not loop:
+        # 创建会话不涉及await，单线程的事件循环中不会并发创建多个；
+        # 连接池保持keep-alive连接并缓存DNS，后续请求省去TCP/TLS握手
+        connector = aiohttp.TCPConnector(
+            limit=64, limit_per_host=32, keepalive_timeout=60, ttl_dns_cache=300
+        )
+        _aiohttp_session = aiohttp.ClientSession(connector=connector)
+        _aiohttp_session_loop = loop
+    return _aiohttp_session
+
+
+# 可重试的HTTP状态码（限流和服务端错误）
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+async def post_json_with_retry(
+    url: str,
+    payload: Any,
+    headers: Dict[str, str],
+    timeout_seconds: float,
+    max_attempts: int = 4,
+) -> Any:
+    """通过共享会话POST JSON并解析响应，连接错误、超时和RETRY_STATUSES按指数退避（带抖动）重试
+
+    请求体的序列化和响应的解析使用orjson
+
+    Args:
+        url: 请求地址
+        payload: 请求体
+        headers: 请求头
+        timeout_seconds: 单次请求的超时时间（秒）
+        max_attempts: 最多尝试次数
+
+    Returns:
+        解析后的响应JSON
+
+    Raises:
+        aiohttp.ClientError: 最后一次尝试仍失败，或返回不可重试的错误状态
+        asyncio.TimeoutError: 最后一次尝试仍超时
+    """
+    body = orjson.dumps(payload)
+    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+
+    for attempt in range(max_attempts):
+        last_attempt = attempt + 1 >= max_attempts
+        try:
+            session = await get_aiohttp_session()
+            async with session.post(url, data=body, headers=headers, timeout=timeout) as response:
+                if response.status not in RETRY_STATUSES or last_attempt:
+                    response.raise_for_status()
+                    content = await response.read()
+                    return orjson.loads(content)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+
+        # 0.25秒起指数增长，上限8秒，加入抖动避免并发请求同时重试
+        await asyncio.sleep(min(8.0, 0.25 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+async def close_aiohttp_session() -> None:
+    """关闭共享的aiohttp会话，程序退出前调用"""
+    global _aiohttp_session, _aiohttp_session_loop
+    if _aiohttp_session is not None and not _aiohttp_session.closed:
+        await _aiohttp_session.close()
+    _aiohttp_session = None
+    _aiohttp_session_loop = None
@@ -1,15 +1,15 @@
 """
 安全生成器 - 用于生成对象的安全包装
 """
+import asyncio
 import json
 import traceback
 from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar, Union, Dict, Type, cast
 
 import hjson
 from json_repair import repair_json
-from openai import OpenAI
 
-from ..config import OPENAI_API_KEY, OPENAI_BASE_URL, get_model, get_tool_config
+from ..config import get_model, get_tool_config, get_openai_client
 from .token_tracker import TokenTracker
 
 T = TypeVar('T')
@@ -160,7 +160,7 @@ class ObjectGeneratorSafe:
         
         try:
             # 主要尝试使用主模型
-            client = OpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
+            client = get_openai_client()
             
             model_config = get_model(model)
             tool_config = get_tool_config(model)
@@ -173,7 +173,9 @@ class ObjectGeneratorSafe:
             elif messages:
                 api_messages.extend(messages)
             
-            response = client.chat.completions.create(
+            # 同步客户端放到线程中执行，避免阻塞事件循环，使其他协程的I/O可以与LLM调用重叠
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
                 model=model_config["model"],
                 messages=api_messages,
                 response_format={
@@ -187,7 +189,11 @@ class ObjectGeneratorSafe:
             )
 
             content = response.choices[0].message.content
-            result = repair_json(content, return_objects=True)
+            # strict模式下响应通常是合法JSON，先用标准解析，失败时再做修复
+            try:
+                result = json.loads(content)
+            except (json.JSONDecodeError, TypeError):
+                result = repair_json(content, return_objects=True)
             
             usage = {
                 "prompt_tokens": response.usage.prompt_tokens,
@@ -233,11 +239,12 @@ class ObjectGeneratorSafe:
                         # 创建没有描述的简化模式版本
                         distilled_schema = self._create_distilled_schema(schema)
                         
-                        client = OpenAI()
+                        client = get_openai_client()
                         fallback_model = get_model('fallback')
                         fallback_config = get_tool_config('fallback')
                         
-                        fallback_response = client.chat.completions.create(
+                        fallback_response = await asyncio.to_thread(
+                            client.chat.completions.create,
                             model=fallback_model,
                             messages=[{
                                 "role": "user", 
@@ -2,10 +2,11 @@
 模式定义模块，用于生成和验证各种操作所需的数据结构。
 """
 
+import functools
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Literal, Optional, Any
-from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional, Any, Tuple
+from pydantic import BaseModel, ConfigDict, Field
 
 from .safe_generator import ObjectGeneratorSafe
 from ..model_types import EvaluationType, PromptPair
@@ -61,6 +62,52 @@ Evaluation: {
 </examples>"""
 
 
+@functools.lru_cache(maxsize=None)
+def _question_evaluate_schema() -> Dict:
+    """生成问题评估模式"""
+
+    class QuestionEvaluateSchema(BaseModel):
+        """问题评估模式"""
+
+        think: str = Field(
+            ...,
+            description="A very concise explain of why those checks are needed.",
+        )
+        needs_definitive: bool
+        needs_freshness: bool
+        needs_plurality: bool
+        needs_completeness: bool
+
+        model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
+
+    return QuestionEvaluateSchema.model_json_schema()
+
+
+@functools.lru_cache(maxsize=None)
+def _error_analysis_schema() -> Dict:
+    """生成错误分析模式"""
+
+    class ErrorAnalysisSchema(BaseModel):
+        """错误分析模式"""
+
+        recap: str = Field(
+            ...,
+            description="Recap of the actions taken and the steps conducted in first person narrative.",
+        )
+        blame: str = Field(
+            ...,
+            description="Which action or the step was the root cause of the answer rejection.",
+        )
+        improvement: str = Field(
+            ...,
+            description="Suggested key improvement for the next iteration, do not use bullet points, be concise and hot-take vibe.",
+        )
+
+        model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
+
+    return ErrorAnalysisSchema.model_json_schema()
+
+
 def get_language_prompt(question: str) -> PromptPair:
     """生成用于识别语言和问题语气的提示"""
     return PromptPair(system=LANGUAGE_PROMPT_SYSTEM, user=question)
@@ -72,6 +119,10 @@ class JsonSchemaGen:
     def __init__(self):
         self.language_style = "formal English"
         self.language_code = "en"
+        # get_agent_schema的结果缓存，键包含动作开关、问题和语言设置
+        self._agent_schema_cache: Dict[Tuple, Dict] = {}
+        # get_evaluator_schema的结果缓存
+        self._evaluator_schema_cache: Dict[Tuple, Dict] = {}
 
     async def set_language(self, query: str):
         """设置语言和语气风格
@@ -109,30 +160,16 @@ class JsonSchemaGen:
                 description="[vibe & tone] in [what language], such as formal english, informal chinese, technical german, humor english, slang, genZ, emojis etc.",
             )
 
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
+            model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-        return LanguageSchema.schema()
+        return LanguageSchema.model_json_schema()
 
     def get_question_evaluate_schema(self) -> Dict:
-        """获取问题评估模式"""
+        """获取问题评估模式
 
-        class QuestionEvaluateSchema(BaseModel):
-            """问题评估模式"""
-
-            think: str = Field(
-                ...,
-                description="A very concise explain of why those checks are needed.",
-            )
-            needs_definitive: bool
-            needs_freshness: bool
-            needs_plurality: bool
-            needs_completeness: bool
-
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
-
-        return QuestionEvaluateSchema.schema()
+        模式与语言设置无关，整个进程只生成一次；返回的字典被共享，调用方不应修改
+        """
+        return _question_evaluate_schema()
 
     def get_code_generator_schema(self) -> Dict:
         """获取代码生成器模式"""
@@ -149,34 +186,16 @@ class JsonSchemaGen:
                 description="The JavaScript code that solves the problem and always use 'return' statement to return the result. Focus on solving the core problem; No need for error handling or try-catch blocks or code comments. No need to declare variables that are already available, especially big long strings or arrays.",
             )
 
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
+            model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-        return CodeGeneratorSchema.schema()
+        return CodeGeneratorSchema.model_json_schema()
 
     def get_error_analysis_schema(self) -> Dict:
-        """获取错误分析模式"""
-
-        class ErrorAnalysisSchema(BaseModel):
-            """错误分析模式"""
+        """获取错误分析模式
 
-            recap: str = Field(
-                ...,
-                description="Recap of the actions taken and the steps conducted in first person narrative.",
-            )
-            blame: str = Field(
-                ...,
-                description="Which action or the step was the root cause of the answer rejection.",
-            )
-            improvement: str = Field(
-                ...,
-                description="Suggested key improvement for the next iteration, do not use bullet points, be concise and hot-take vibe.",
-            )
-
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
-
-        return ErrorAnalysisSchema.schema()
+        模式与语言设置无关，整个进程只生成一次；返回的字典被共享，调用方不应修改
+        """
+        return _error_analysis_schema()
 
     def get_query_rewriter_schema(self) -> Dict:
         """获取查询重写器模式"""
@@ -196,8 +215,7 @@ class JsonSchemaGen:
             )
             q: str = Field(..., description="keyword-based search query")
 
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
+            model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
         class QueryRewriterSchema(BaseModel):
             """查询重写器模式"""
@@ -210,14 +228,31 @@ class JsonSchemaGen:
                 description=f"Array of search keywords queries, orthogonal to each other. Maximum {MAX_QUERIES_PER_STEP} queries allowed.",
             )
 
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
+            model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-        return QueryRewriterSchema.schema()
+        return QueryRewriterSchema.model_json_schema()
 
     def get_evaluator_schema(self, eval_type: EvaluationType) -> Dict:
         """获取评估器模式
 
+        每次回答都要做多项评估，结果按评估类型、语言设置和日期（时效性描述包含当天日期）缓存；
+        返回的字典被共享，调用方不应修改
+        """
+        key = (
+            eval_type,
+            self.language_style,
+            self.language_code,
+            datetime.now().strftime('%Y-%m-%d'),
+        )
+        schema = self._evaluator_schema_cache.get(key)
+        if schema is None:
+            schema = self._build_evaluator_schema(eval_type)
+            self._evaluator_schema_cache[key] = schema
+        return schema
+
+    def _build_evaluator_schema(self, eval_type: EvaluationType) -> Dict:
+        """生成评估器模式
+
         Args:
             eval_type: 评估类型
 
@@ -233,8 +268,7 @@ class JsonSchemaGen:
 
             think: str = Field( ..., description=f"Explanation the thought process why the answer does not pass the evaluation, {self.get_language_prompt()}", )
             pass_eval: bool = Field( ..., description="If the answer passes the test defined by the evaluator", )
-            class Config:
-                extra = "forbid"  # 相当于 additionalProperties = False
+            model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
         if eval_type == EvaluationType.DEFINITIVE:
 
@@ -243,10 +277,9 @@ class JsonSchemaGen:
 
                 type: Literal["definitive"] = Field( ... )
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return DefinitiveEvaluatorSchema.schema()
+            return DefinitiveEvaluatorSchema.model_json_schema()
 
         elif eval_type == EvaluationType.FRESHNESS:
 
@@ -256,8 +289,7 @@ class JsonSchemaGen:
                 days_ago: int = Field( ..., description=f"datetime of the **answer** and relative to {datetime.now().strftime('%Y-%m-%d')}")
                 max_age_days: Optional[int] = Field( ..., description="Maximum allowed age in days for this kind of question-answer type before it is considered outdated")
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
             class FreshnessEvaluatorSchema(BaseEvaluatorSchema):
                 """Schema for freshness evaluator"""
@@ -265,10 +297,9 @@ class JsonSchemaGen:
                 type: Literal["freshness"] = Field(...)
                 freshness_analysis: FreshnessAnalysis
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return FreshnessEvaluatorSchema.schema()
+            return FreshnessEvaluatorSchema.model_json_schema()
 
         elif eval_type == EvaluationType.PLURALITY:
 
@@ -277,8 +308,7 @@ class JsonSchemaGen:
 
                 minimum_count_required: int = Field(..., description="Minimum required number of items from the **question**", )
                 actual_count_provided: int = Field( ..., description="Number of items provided in **answer**" )
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
             class PluralityEvaluatorSchema(BaseEvaluatorSchema):
                 """Schema for plurality evaluator"""
@@ -286,10 +316,9 @@ class JsonSchemaGen:
                 type: Literal["plurality"] = Field(...)  # Using Literal to restrict values
                 plurality_analysis: PluralityAnalysis
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return PluralityEvaluatorSchema.schema()
+            return PluralityEvaluatorSchema.model_json_schema()
 
         elif eval_type == EvaluationType.ATTRIBUTION:
 
@@ -299,10 +328,9 @@ class JsonSchemaGen:
                 type: Literal["attribution"] = Field(...)
                 exact_quote: Optional[str] = Field(..., description="Exact relevant quote and evidence from the source that strongly support the answer and justify this question-answer pair")
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return AttributionEvaluatorSchema.schema()
+            return AttributionEvaluatorSchema.model_json_schema()
 
         elif eval_type == EvaluationType.COMPLETENESS:
 
@@ -312,8 +340,7 @@ class JsonSchemaGen:
                 aspects_expected: str = Field(..., description="Comma-separated list of all aspects or dimensions that the question explicitly asks for." )
                 aspects_provided: str = Field(..., description="Comma-separated list of all aspects or dimensions that were actually addressed in the answer" )
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
             class CompletenessEvaluatorSchema(BaseEvaluatorSchema):
                 """Schema for completeness evaluator"""
@@ -321,10 +348,9 @@ class JsonSchemaGen:
                 type: Literal["completeness"] = Field(...)
                 completeness_analysis: CompletenessAnalysis
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return CompletenessEvaluatorSchema.schema()
+            return CompletenessEvaluatorSchema.model_json_schema()
         elif eval_type == EvaluationType.STRICT:
 
             class StrictEvaluatorSchema(BaseEvaluatorSchema):
@@ -333,10 +359,9 @@ class JsonSchemaGen:
                 type: Literal["strict"] = Field(...)
                 improvement_plan: str = Field( ..., description="Explain how a perfect answer should look like and what are needed to improve the current answer. Starts with 'For the best answer, you must...'")
 
-                class Config:
-                    extra = "forbid"  # 相当于 additionalProperties = False
+                model_config = ConfigDict(extra="forbid")  # 相当于 additionalProperties = False
 
-            return StrictEvaluatorSchema.schema()
+            return StrictEvaluatorSchema.model_json_schema()
         else:
             raise ValueError(f"Unknown evaluation type: {eval_type}")
 
@@ -349,7 +374,44 @@ class JsonSchemaGen:
         allow_coding: bool,
         current_question: Optional[str] = None,
     ) -> Dict:
+        """获取代理动作模式
+
+        同一组输入在一次会话中会反复出现（固定的前几步和野兽模式），结果按输入缓存；
+        返回的字典被共享，调用方不应修改
+        """
+        key = (
+            bool(allow_reflect),
+            bool(allow_read),
+            bool(allow_answer),
+            bool(allow_search),
+            bool(allow_coding),
+            current_question if allow_reflect else None,  # 只有反思描述用到问题
+            self.language_style,
+            self.language_code,
+        )
+        schema = self._agent_schema_cache.get(key)
+        if schema is None:
+            schema = self._build_agent_schema(
+                allow_reflect,
+                allow_read,
+                allow_answer,
+                allow_search,
+                allow_coding,
+                current_question,
+            )
+            self._agent_schema_cache[key] = schema
+        return schema
 
+    def _build_agent_schema(
+        self,
+        allow_reflect: bool,
+        allow_read: bool,
+        allow_answer: bool,
+        allow_search: bool,
+        allow_coding: bool,
+        current_question: Optional[str] = None,
+    ) -> Dict:
+        """构建代理动作模式"""
         action_schemas = {}
 
         if allow_search:
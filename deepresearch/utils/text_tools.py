@@ -1,15 +1,24 @@
 """
 文本工具函数
 """
+import functools
 import json
 import os
 import re
 import random
+import string
 from typing import Dict, List, Any, Optional, Union
 from ..model_types import AnswerAction, KnowledgeItem, Reference
 from html.parser import HTMLParser
 from io import StringIO
 
+# HTML标签匹配正则（允许缺少结尾的">"）
+_HTML_TAG_RE = re.compile(r'<[^>]*>?')
+# 换行符处理正则，每次组装提示和知识项时都会用到
+_LINE_BREAK_RE = re.compile(r'\r\n|\n|\r')
+# 恰好两个换行符时替换结果不变，只需匹配三个及以上
+_EXTRA_LINE_BREAKS_RE = re.compile(r'\n{3,}')
+
 
 def load_i18n_data():
     """
@@ -82,7 +91,7 @@ def remove_html_tags(text: str) -> str:
     Returns:
         移除HTML标签后的文本
     """
-    return re.sub(r'<[^>]*>?', '', text)
+    return _HTML_TAG_RE.sub('', text)
 
 
 def remove_all_line_breaks(text: str) -> str:
@@ -95,7 +104,7 @@ def remove_all_line_breaks(text: str) -> str:
     Returns:
         移除换行符后的文本
     """
-    return re.sub(r'(\r\n|\n|\r)', ' ', text)
+    return _LINE_BREAK_RE.sub(' ', text)
 
 
 def remove_extra_line_breaks(text: str) -> str:
@@ -108,7 +117,7 @@ def remove_extra_line_breaks(text: str) -> str:
     Returns:
         处理后的文本
     """
-    return re.sub(r'\n{2,}', '\n\n', text)
+    return _EXTRA_LINE_BREAKS_RE.sub('\n\n', text)
 
 
 def build_md_from_answer(answer: AnswerAction) -> str:
@@ -195,10 +204,14 @@ def repair_markdown_footnotes(markdown_string: str, references: Optional[List[Re
 """.strip()
 
 
+@functools.lru_cache(maxsize=10000)
 def smart_merge_strings(str1: str, str2: str) -> str:
     """
     智能合并两个字符串
     
+    重叠查找为O(n²)，而同一URL的标题和描述在rank_urls和get_prompt中每步都会合并一次，
+    因此按输入缓存结果
+    
     Args:
         str1: 第一个字符串
         str2: 第二个字符串
@@ -361,19 +374,25 @@ def fix_code_block_indentation(markdown_text: str) -> str:
     return '\n'.join(result)
 
 
-def get_knowledge_str(all_knowledge: List['KnowledgeItem']) -> str:
+def get_knowledge_str(
+    all_knowledge: List['KnowledgeItem'], knowledge_strings: Optional[List[str]] = None
+) -> str:
     """
     将知识项列表转换为格式化字符串
     
     Args:
         all_knowledge: 知识项列表
+        knowledge_strings: 可选的已格式化知识项缓存（all_knowledge只追加时可用），
+            只格式化新增的知识项并追加到缓存中
         
     Returns:
         格式化的知识字符串
     """
-    knowledge_strings = []
+    if knowledge_strings is None:
+        knowledge_strings = []
     
-    for idx, k in enumerate(all_knowledge):
+    for idx in range(len(knowledge_strings), len(all_knowledge)):
+        k = all_knowledge[idx]
         msg = f"<knowledge-{idx + 1}>\n{k.question}\n\n"
         
         # 添加日期时间（如果有）
@@ -392,6 +411,65 @@ def get_knowledge_str(all_knowledge: List['KnowledgeItem']) -> str:
     return "\n\n".join(knowledge_strings)
 
 
+class PrecompiledTemplate:
+    """
+    预先编译的字符串模板
+
+    第一次format时用string.Formatter解析一次模板，并生成一个直接拼接字面量和字段值的渲染函数
+    （与collections.namedtuple生成代码的方式相同），避免str.format每次调用都重新解析模板；
+    只在错误分析、Markdown修复等少见路径上使用的模板因此不会在导入时付出编译开销。
+    只支持简单的{name}字段，含格式说明、转换或属性访问的模板回退到str.format。
+    """
+
+    __slots__ = ("template", "_render", "_compiled")
+
+    def __init__(self, template: str):
+        self.template = template
+        self._render = None
+        self._compiled = False
+
+    @staticmethod
+    def _compile(template: str):
+        # 字面量比字段多一个：literals[0] field[0] literals[1] ... literals[-1]
+        literals: List[str] = [""]
+        fields: List[str] = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            literals[-1] += literal
+            if field is None:
+                continue
+            if spec or conversion or not field.isidentifier():
+                return None
+            fields.append(field)
+            literals.append("")
+
+        # 生成相邻字面量拼接成的f-string，编译器会直接产出FORMAT_VALUE/BUILD_STRING指令；
+        # 字面量用repr嵌入（普通字符串中的花括号无需转义），字段名已确认是合法标识符
+        parts = []
+        for idx, field in enumerate(fields):
+            if literals[idx]:
+                parts.append(repr(literals[idx]))
+            parts.append(f"f\"{{kw['{field}']}}\"")
+        if literals[-1]:
+            parts.append(repr(literals[-1]))
+        if not parts:
+            parts.append("''")
+
+        namespace: Dict[str, Any] = {}
+        exec(f"def _render(kw): return ({' '.join(parts)})", namespace)
+        return namespace["_render"]
+
+    def format(self, **kwargs: Any) -> str:
+        if not self._compiled:
+            self._render = self._compile(self.template)
+            self._compiled = True
+        if self._render is None:
+            return self.template.format(**kwargs)
+        return self._render(kwargs)
+
+    def __str__(self) -> str:
+        return self.template
+
+
 class HTMLTableParser(HTMLParser):
     """
     HTML表格解析器类，用于将HTML表格转换为Markdown格式
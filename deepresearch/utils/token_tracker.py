@@ -23,6 +23,7 @@ class TokenTracker(EventEmitter):
         super().__init__()
         self.budget = budget
         self.usages: List[Dict[str, Any]] = []
+        self._total_tokens = 0  # total_tokens的累计值，避免每次遍历usages
         self.encoding = tiktoken.get_encoding("cl100k_base")  # OpenAI的标准编码
 
         # 检查全局上下文对象是否可用，类似TS版本中的asyncLocalContext
@@ -34,9 +35,7 @@ class TokenTracker(EventEmitter):
                     hasattr(async_local_context, "available")
                     and async_local_context.available()
                 ):
-                    async_local_context.ctx.chargeAmount = self.get_total_usage()[
-                        "total_tokens"
-                    ]
+                    async_local_context.ctx.chargeAmount = self.total_tokens
 
             self.on("usage", on_usage_callback)
 
@@ -50,8 +49,16 @@ class TokenTracker(EventEmitter):
         """
         u = {"tool": tool, "usage": usage}
         self.usages.append(u)
+        self._total_tokens += usage.get("total_tokens") or 0
         self.emit("usage", usage)
 
+    @property
+    def total_tokens(self) -> int:
+        """
+        已使用的令牌总数，与get_total_usage()["total_tokens"]一致，但无需重新累加
+        """
+        return self._total_tokens
+
     def get_total_usage(self) -> Dict[str, int]:
         """
         获取总的令牌使用情况
@@ -101,3 +108,4 @@ class TokenTracker(EventEmitter):
         重置令牌使用记录
         """
         self.usages = []
+        self._total_tokens = 0
@@ -1,6 +1,8 @@
 import re
 import random
 import asyncio
+import functools
+import heapq
 import sys
 from pathlib import Path
 from typing import Dict, List, Tuple, Any, Optional, Set, Union, Callable
@@ -112,7 +114,26 @@ def normalize_url(
 ) -> Optional[str]:
     """
     规范化URL，移除跟踪参数、会话ID和其他常见的变体
+
+    默认选项下的结果会被缓存并驻留(sys.intern)，同一URL在一次会话中会被反复规范化，
+    且规范化后的URL会同时作为all_urls的键、visited/bad集合的元素和引用URL
     """
+    if options is None and not debug:
+        return _normalize_url_cached(url_string)
+    return _normalize_url(url_string, debug, options)
+
+
+@functools.lru_cache(maxsize=100_000)
+def _normalize_url_cached(url_string: str) -> Optional[str]:
+    """默认选项下normalize_url的缓存版本，返回驻留的字符串"""
+    normalized_url = _normalize_url(url_string)
+    return sys.intern(normalized_url) if normalized_url else normalized_url
+
+
+def _normalize_url(
+    url_string: str, debug: bool = False, options: Dict[str, bool] = None
+) -> Optional[str]:
+    """normalize_url的实际实现"""
     if options is None:
         options = {
             "remove_anchors": True,
@@ -267,36 +288,45 @@ def normalize_url(
 
 def filter_urls(
     all_urls: Dict[str, SearchSnippet],
-    visited_urls: List[str],
+    visited_urls: Union[List[str], Set[str]],
     bad_hostnames: List[str],
     only_hostnames: List[str],
 ) -> List[SearchSnippet]:
     """过滤URL列表，排除已访问的和不良主机名的URL"""
-    return [
-        snippet
-        for url, snippet in all_urls.items()
-        if (
-            url not in visited_urls
-            and extract_url_parts(url)["hostname"] not in bad_hostnames
-            and (
-                not only_hostnames
-                or extract_url_parts(url)["hostname"] in only_hostnames
-            )
-        )
-    ]
+    # 主机名列表在循环中会被反复查询，先转为集合
+    bad_hostname_set = set(bad_hostnames)
+    only_hostname_set = set(only_hostnames)
+    result = []
+    for url, snippet in all_urls.items():
+        if url in visited_urls:
+            continue
+        hostname = _parse_url_parts(url)[0]
+        if hostname in bad_hostname_set:
+            continue
+        if only_hostname_set and hostname not in only_hostname_set:
+            continue
+        result.append(snippet)
+    return result
 
 
-def extract_url_parts(url_str: str) -> Dict[str, str]:
-    """从URL中提取主机名和路径"""
+@functools.lru_cache(maxsize=10000)
+def _parse_url_parts(url_str: str) -> Tuple[str, str]:
+    """解析URL的(主机名, 路径)，同一URL在每一步排序中会被多次解析，因此缓存结果"""
     try:
         url = urlparse(url_str)
-        return {
-            "hostname": url.hostname or "",
-            "path": url.pathname if hasattr(url, "pathname") else url.path or "",
-        }
+        return (
+            url.hostname or "",
+            url.pathname if hasattr(url, "pathname") else url.path or "",
+        )
     except Exception as e:
         print(f"Error parsing URL: {url_str}", e)
-        return {"hostname": "", "path": ""}
+        return "", ""
+
+
+def extract_url_parts(url_str: str) -> Dict[str, str]:
+    """从URL中提取主机名和路径"""
+    hostname, path = _parse_url_parts(url_str)
+    return {"hostname": hostname, "path": path}
 
 
 def count_url_parts(url_items: List[SearchSnippet]) -> Dict[str, Any]:
@@ -310,9 +340,7 @@ def count_url_parts(url_items: List[SearchSnippet]) -> Dict[str, Any]:
             continue
 
         total_urls += 1
-        parts = extract_url_parts(item.url)
-        hostname = parts["hostname"]
-        path = parts["path"]
+        hostname, path = _parse_url_parts(item.url)
 
         # 统计主机名
         hostname_count[hostname] = hostname_count.get(hostname, 0) + 1
@@ -340,7 +368,12 @@ async def rank_urls(
     options: Dict[str, Any] = None,
     trackers: TrackerContext = None,
 ) -> List[BoostedSearchSnippet]:
-    """根据多个因素对URL进行排名和加权"""
+    """根据多个因素对URL进行排名和加权
+
+    options中可传入k_per_hostname，在排序后直接限制每个主机名保留的结果数，
+    效果等同于再调用keep_k_per_hostname，但无需再次遍历和解析URL；
+    传入max_results时只选出分数最高的前max_results个结果，无需对全部URL排序
+    """
     if options is None:
         options = {}
 
@@ -354,27 +387,41 @@ async def rank_urls(
     max_boost = options.get("max_boost", 5)
     question = options.get("question", "")
     boost_hostnames = options.get("boost_hostnames", [])
+    k_per_hostname = options.get("k_per_hostname")
+    max_results = options.get("max_results")
 
-    # 首先计算URL部分
-    counts = count_url_parts(url_items)
-    hostname_count = counts["hostname_count"]
-    path_prefix_count = counts["path_prefix_count"]
-    total_urls = counts["total_urls"]
+    # 一次遍历完成：URL解析、主机名/路径前缀计数、合并内容去重
+    valid_items = []  # (item, hostname, path_prefixes, merged_content)
+    hostname_count: Dict[str, int] = {}
+    path_prefix_count: Dict[str, int] = {}
+    unique_content_map: Dict[str, List[int]] = {}
 
-    # 如果有问题，使用Jina重新排名
-    if question and question.strip():
-        # 第1步：创建一个记录来跟踪具有原始索引的唯一内容
-        unique_content_map = {}
+    for item in url_items:
+        if not item or not hasattr(item, "url") or not item.url:
+            print("Skipping invalid item:", item)
+            continue
 
-        for i, item in enumerate(url_items):
-            merged_content = smart_merge_strings(item.title, item.description)
+        hostname, path = _parse_url_parts(item.url)
+        hostname_count[hostname] = hostname_count.get(hostname, 0) + 1
 
-            if merged_content not in unique_content_map:
-                unique_content_map[merged_content] = [i]
-            else:
-                unique_content_map[merged_content].append(i)
+        path_segments = [s for s in path.split("/") if s]
+        path_prefixes = [
+            "/" + "/".join(path_segments[: depth + 1])
+            for depth in range(len(path_segments))
+        ]
+        for prefix in path_prefixes:
+            path_prefix_count[prefix] = path_prefix_count.get(prefix, 0) + 1
+
+        merged_content = smart_merge_strings(item.title, item.description)
+        unique_content_map.setdefault(merged_content, []).append(len(valid_items))
+
+        valid_items.append((item, hostname, path_prefixes, merged_content))
 
-        # 第2步：仅对唯一内容进行重新排名
+    total_urls = len(valid_items)
+    jina_rerank_boosts = [0] * total_urls
+
+    # 如果有问题，仅对唯一内容使用Jina重新排名
+    if question and question.strip() and valid_items:
         unique_contents = list(unique_content_map.keys())
         unique_indices_map = list(unique_content_map.values())
         print(f"【rerank_documents】: {len(url_items)}->{len(unique_contents)}")
@@ -383,7 +430,6 @@ async def rank_urls(
             results = await rerank_documents(
                 query=question, documents=unique_contents, tracker_context=trackers
             )
-            jina_rerank_boosts = [0 for _ in range(len(url_items))]
 
             for result in results.get("results", []):
                 index = result.get("index", 0)
@@ -398,15 +444,7 @@ async def rank_urls(
     # 计算最终得分并创建排名结果
     result_items = []
 
-    for i, item in enumerate(url_items):
-        if not item or not hasattr(item, "url") or not item.url:
-            print("Skipping invalid item:", item)
-            continue
-
-        parts = extract_url_parts(item.url)
-        hostname = parts["hostname"]
-        path = parts["path"]
-
+    for i, (item, hostname, path_prefixes, merged_content) in enumerate(valid_items):
         # 基本权重
         freq = getattr(item, "weight", 0)
 
@@ -420,16 +458,11 @@ async def rank_urls(
 
         # 路径提升（考虑所有路径前缀，对更长的路径应用衰减）
         path_boost = 0
-        path_segments = [s for s in path.split("/") if s]
-
-        for i, segment in enumerate(path_segments):
-            prefix = "/" + "/".join(path_segments[: i + 1])
-            prefix_count = path_prefix_count.get(prefix, 0)
-            prefix_freq = normalize_count(prefix_count, total_urls)
+        for depth, prefix in enumerate(path_prefixes):
+            prefix_freq = normalize_count(path_prefix_count.get(prefix, 0), total_urls)
 
             # 根据路径深度应用衰减因子
-            decayed_boost = prefix_freq * (decay_factor**i) * path_boost_factor
-            path_boost += decayed_boost
+            path_boost += prefix_freq * (decay_factor**depth) * path_boost_factor
 
         freq_boost = freq / total_urls * freq_factor if total_urls > 0 else 0
 
@@ -443,23 +476,56 @@ async def rank_urls(
             max_boost,
         )
 
-        # 创建包含所有提升因素的结果项
-        result_item = BoostedSearchSnippet(
+        # 创建包含所有提升因素的结果项；字段来自已校验的SearchSnippet和上面算出的浮点数，
+        # 用model_construct跳过重复校验，URL较多时每步可省下大量构造开销
+        result_item = BoostedSearchSnippet.model_construct(
             freq_boost=freq_boost,
             hostname_boost=hostname_boost,
             path_boost=path_boost,
             jina_rerank_boost=jina_rerank_boost,
             final_score=final_score,
             score=final_score,
-            merged=smart_merge_strings(item.title, item.description),
+            merged=merged_content,
             **item.__dict__,
         )
 
-        result_items.append(result_item)
+        result_items.append((result_item, hostname))
+
+    if max_results is None:
+        # 按最终分数排序
+        result_items.sort(key=lambda x: x[0].final_score, reverse=True)
+        ranked = iter(result_items)
+    elif not k_per_hostname:
+        # 只需前max_results个，nlargest为O(N log K)，且与稳定排序后截断的结果一致
+        return [
+            r
+            for r, _ in heapq.nlargest(
+                max_results, result_items, key=lambda x: x[0].final_score
+            )
+        ]
+    else:
+        # 每个主机名的上限使所需候选数不确定，用堆按分数依次弹出，凑满即停；
+        # 下标作为第二关键字，保证同分时与稳定排序的顺序一致
+        heap = [(-r.final_score, idx) for idx, (r, _) in enumerate(result_items)]
+        heapq.heapify(heap)
+        ranked = (
+            result_items[heapq.heappop(heap)[1]] for _ in range(len(heap))
+        )
+
+    if not k_per_hostname:
+        return [r for r, _ in ranked]
 
-    # 按最终分数排序
-    result_items.sort(key=lambda x: x.final_score, reverse=True)
-    return result_items
+    # 每个主机名最多保留k_per_hostname个结果
+    kept_per_hostname: Dict[str, int] = {}
+    capped_results = []
+    for result_item, hostname in ranked:
+        kept = kept_per_hostname.get(hostname, 0)
+        if kept < k_per_hostname:
+            capped_results.append(result_item)
+            kept_per_hostname[hostname] = kept + 1
+            if max_results is not None and len(capped_results) >= max_results:
+                break
+    return capped_results
 
 
 # async def apply_rerank_boost(
@@ -538,8 +604,8 @@ def sort_select_urls(
                 }
             )
 
-    # 按分数降序排序并限制数量
-    return sorted(result, key=lambda x: x.get("score", 0) or 0, reverse=True)[:max_urls]
+    # 按分数降序选出前max_urls个，无需对全部URL排序
+    return heapq.nlargest(max_urls, result, key=lambda x: x.get("score", 0) or 0)
 
 
 def sample_multinomial(items: List[Tuple[Any, float]]) -> Optional[Any]:
@@ -597,7 +663,7 @@ def keep_k_per_hostname(
     filtered_results = []
 
     for result in results:
-        hostname = extract_url_parts(result.url).get("hostname", "")
+        hostname = _parse_url_parts(result.url)[0]
 
         if hostname not in hostname_map:
             hostname_map[hostname] = 0
@@ -658,8 +724,9 @@ async def process_urls(
 
     # 从all_urls中删除任何具有不良主机名的URL
     if bad_hostnames:
+        bad_hostname_set = set(bad_hostnames)
         for url in list(all_urls.keys()):
-            if extract_url_parts(url)["hostname"] in bad_hostnames:
+            if _parse_url_parts(url)[0] in bad_hostname_set:
                 del all_urls[url]
                 print(f"Removed {url} from all_urls")
 
@@ -829,22 +896,28 @@ def fix_bad_url_md_links(md_content: str, all_urls: Dict[str, SearchSnippet]) ->
     return re.sub(md_link_regex, replace_match, md_content)
 
 
+# extract_urls_with_description使用的预编译正则
+# 使用更精确的正则表达式进行URL检测，适用于多语言文本
+_URL_RE = re.compile(
+    r"https?:\/\/(?:www\.)?[-a-zA-Z0-9@:%._+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_+.~#?&//=]*)"
+)
+_URL_TRAILING_PUNCT = tuple(".,;:!?)")  # 需要从URL末尾清理的标点符号
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
 def extract_urls_with_description(
     text: str, context_window_size: int = 50
 ) -> List[SearchSnippet]:
     """从文本中提取URL及其上下文描述"""
-    # 使用更精确的正则表达式进行URL检测，适用于多语言文本
-    url_pattern = r"https?:\/\/(?:www\.)?[-a-zA-Z0-9@:%._+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_+.~#?&//=]*)"
-
     # 查找所有匹配项
     matches = []
 
-    for match in re.finditer(url_pattern, text):
+    for match in _URL_RE.finditer(text):
         url = match.group(0)
         length = len(url)
 
         # 清理尾随标点符号（句号、逗号等）
-        if re.search(r"[.,;:!?)]$", url):
+        if url.endswith(_URL_TRAILING_PUNCT):
             url = url[:-1]
             length = len(url)
 
@@ -893,7 +966,7 @@ def extract_urls_with_description(
             description = "No context available"
 
         # 清理描述
-        description = re.sub(r"\s+", " ", description).strip()
+        description = _WHITESPACE_RE.sub(" ", description).strip()
 
         results.append(
             SearchSnippet(
@@ -7,6 +7,7 @@ DeepResearch Agent 运行脚本
 import sys
 import asyncio
 from deepresearch.agent import get_response
+from deepresearch.utils.http_client import close_aiohttp_session
 
 async def main():
     """主函数"""
@@ -26,6 +27,8 @@ async def main():
         print(f"发生错误: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        await close_aiohttp_session()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file